@@ -1,3 +1,18 @@
-from .colornamespace import ColorNameMapper, FileReadError
+from .engine import ColorSpaceMap, COLOR_NAMES
+from .octree import LabelOctree
+from .sampling import ColorSampler
+from .session import Session, FileReadError, load_session, save_session
+from .compare import SessionComparison
+from .consensus import ConsensusMap, build_consensus
+from .classifier import classify, label_image
+from .profiling import PROFILER, Profiler
+from .store import MapStore
 
-__version__ = '0.8.1'
\ No newline at end of file
+__version__ = '0.8.1'
+
+def __getattr__(name):
+    # The GUI pulls in tkinter and PIL, so it is only imported when asked for.
+    if name == 'ColorNameMapper':
+        from . import colornamespace
+        return getattr(colornamespace,name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
\ No newline at end of file
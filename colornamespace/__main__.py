@@ -1,5 +1,46 @@
+import sys
+
+
+def build_maps_command(argv):
+    from argparse import ArgumentParser
+    from glob import glob
+    from .batch import build_maps, SECTIONS
+    parser = ArgumentParser(prog='python -m colornamespace build-maps',description='Build color name maps from saved session files.')
+    parser.add_argument('files',nargs='+',help='session files (.txt, .csv, .json or .npy); wildcards are expanded')
+    parser.add_argument('--space',choices=('rgb','hsv','both'),default='hsv',help='color space of the maps (default: hsv)')
+    parser.add_argument('--out',default='maps',help='output directory (default: maps)')
+    parser.add_argument('--format',choices=('npy','png'),default='npy',help='write label volumes or PNG slices (default: npy)')
+    parser.add_argument('--step',type=int,default=2,help='grid spacing in color units (default: 2)')
+    parser.add_argument('--sections',type=float,nargs='+',default=SECTIONS,help='cross-section percentages for PNG slices')
+    parser.add_argument('--workers',type=int,default=None,help='number of worker processes (default: one per CPU)')
+    args = parser.parse_args(argv)
+
+    files = []
+    for pattern in args.files:
+        files += sorted(glob(pattern)) or [pattern]
+    spaces = ('rgb','hsv') if args.space == 'both' else (args.space,)
+
+    def report(f, result):
+        if isinstance(result,Exception):
+            print(f'{f}: {result}',file=sys.stderr)
+        else:
+            print(f'{f}: {len(result)} file(s) written')
+
+    try:
+        results = build_maps(files,args.out,spaces,args.step,args.format,args.sections,args.workers,report)
+    except ValueError as err:
+        print(err,file=sys.stderr)
+        return 2
+    return 1 if any(isinstance(r,Exception) for r in results.values()) else 0
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'build-maps':
+        sys.exit(build_maps_command(sys.argv[2:]))
     from .colornamespace import ColorNameMapper
     prog = ColorNameMapper()
+    if len(sys.argv) > 1:
+        prog.after_idle(prog.open_session,sys.argv[1])
     prog.mainloop()
 
+if __name__ == '__main__':
+    main()
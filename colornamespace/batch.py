@@ -0,0 +1,71 @@
+'''Headless map building for many session files at once.'''
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+import numpy as np
+from .engine import ColorSpaceMap, VIEWS, render_section
+from .session import load_session
+
+SECTIONS = (0,25,50,75,100)
+
+
+def build_map_file(fpath, outdir, spaces=('hsv',), step=2, fmt='npy', sections=SECTIONS) -> list:
+    '''Build the label volumes of one session file and write them to `outdir`.
+
+    With `fmt` 'npy' each volume is saved as <stem>_<space>.npy; with 'png'
+    every view of each space is rendered at the given cross-section
+    percentages as <stem>_<view>_<value>.png. Returns the written paths.
+    '''
+    fpath = Path(fpath)
+    outdir = Path(outdir)
+    colormap = ColorSpaceMap(load_session(fpath,mmap_mode='r'),step=step)
+    written = []
+    for space in spaces:
+        vol = colormap.volume(space)
+        if fmt == 'npy':
+            out = outdir / f'{fpath.stem}_{space}.npy'
+            np.save(out,vol)
+            written.append(out)
+        elif fmt == 'png':
+            from PIL import Image
+            for view in (v for v,(sp,_) in VIEWS.items() if sp == space):
+                for value in sections:
+                    out = outdir / f'{fpath.stem}_{view}_{value:g}.png'
+                    Image.fromarray(render_section(colormap.section(view,value))).save(out)
+                    written.append(out)
+        else:
+            raise ValueError(f'Unknown output format: {fmt!r}')
+    return written
+
+def build_maps(files, outdir, spaces=('hsv',), step=2, fmt='npy', sections=SECTIONS, workers=None, report=None) -> dict:
+    '''Run build_map_file over many files in a process pool.
+
+    Returns a dict mapping each file to its written paths or to the
+    exception that stopped it. `report`, if given, is called with
+    (file, result) as each file finishes. Raises ValueError before
+    building anything if two files would write maps under the same name.
+    '''
+    files = list(files)
+    _check_names(files)
+    Path(outdir).mkdir(parents=True,exist_ok=True)
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(build_map_file,f,outdir,spaces,step,fmt,sections):f for f in files}
+        for future in as_completed(futures):
+            f = futures[future]
+            try:
+                results[f] = future.result()
+            except Exception as err:
+                results[f] = err
+            if report is not None:
+                report(f,results[f])
+    return results
+
+def _check_names(files) -> None:
+    # Output names come from the file stem alone, so a.csv and a.json, or
+    # a.csv in two directories, would overwrite each other's maps.
+    stems = {}
+    for f in files:
+        stems.setdefault(Path(f).stem,set()).add(Path(f).resolve())
+    clashes = sorted(stem for stem,paths in stems.items() if len(paths) > 1)
+    if clashes:
+        raise ValueError('These files would write maps under the same name: ' + '; '.join(', '.join(str(f) for f in files if Path(f).stem == stem) for stem in clashes))
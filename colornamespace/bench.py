@@ -0,0 +1,384 @@
+'''Benchmarks for colornamespace, printed as JSON.
+
+Run with `python -m colornamespace.bench [suite ...] [--sizes N ...] [--out FILE]`.
+Every suite runs headless: figures are drawn with the Agg backend and the
+startup suite records an error instead of failing when there is no display.
+Timings are the best of a few runs, in seconds, under keys ending in
+'_seconds', so two result files can be compared with `--baseline`.
+'''
+from itertools import cycle
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+import numpy as np
+
+# Modules that should only be imported once the map is first shown.
+DEFERRED_MODULES = ('matplotlib','scipy')
+
+# Numbers of answers in the synthetic sessions.
+SIZES = (100,1000,10000,100000,1000000)
+
+# Each measurement is repeated until it has run `repeat` times or for this many seconds.
+BUDGET = 2.0
+
+_STARTUP_SCRIPT = '''
+import json, sys
+from time import perf_counter
+start = perf_counter()
+result = {'import_seconds':None,'first_color_seconds':None}
+try:
+    import colornamespace.colornamespace
+    result['import_seconds'] = perf_counter()-start
+    app = colornamespace.colornamespace.ColorNameMapper()
+    app.update()
+    result['first_color_seconds'] = perf_counter()-start
+    app.destroy()
+except Exception as err:
+    result['first_color_error' if result['import_seconds'] is not None else 'import_error'] = str(err)
+result['deferred_loaded'] = sorted(m for m in %r if m in sys.modules)
+print(json.dumps(result))
+'''
+
+
+def synthetic_session(n, seed=0, noise=0.05):
+    '''Return a timed Session of `n` random colors named like a plausible participant.
+
+    Each color takes the label whose display color (LABEL_RGB) is nearest,
+    and a fraction `noise` of the answers get a random label instead, so the
+    maps have both large regions and scattered outliers.
+    '''
+    from .engine import LABEL_RGB
+    from .session import Session
+    rng = np.random.default_rng(seed)
+    rgb = rng.integers(0,256,size=(n,3),dtype=np.uint8)
+    labels = np.empty(n,dtype=np.uint8)
+    anchors = LABEL_RGB.astype(np.int32)
+    for a in range(0,n,1 << 16):
+        d = rgb[a:a+(1 << 16),None,:].astype(np.int32) - anchors
+        labels[a:a+(1 << 16)] = (d*d).sum(axis=-1).argmin(axis=1)
+    flip = rng.random(n) < noise
+    labels[flip] = rng.integers(0,len(anchors),size=int(flip.sum()))
+    times = 1.7e9 + np.cumsum(rng.exponential(2.0,n))
+    response_times = rng.lognormal(0.0,0.5,n).astype(np.float32)
+    return Session.from_arrays(rgb,labels,times,response_times)
+
+def _warm():
+    # Import scipy's KD-tree up front so the first timing does not include it.
+    import scipy.spatial
+
+def _best(fn, repeat=3, setup=None) -> float:
+    # Best time of `fn` over up to `repeat` runs, stopping early once BUDGET is spent.
+    best = None
+    spent = 0.0
+    for _ in range(max(repeat,1)):
+        if setup is None:
+            start = perf_counter()
+            fn()
+        else:
+            arg = setup()
+            start = perf_counter()
+            fn(arg)
+        t = perf_counter() - start
+        best = t if best is None else min(best,t)
+        spent += t
+        if spent > BUDGET:
+            break
+    return best
+
+
+def startup(sizes=SIZES, repeat=3) -> dict:
+    '''Time importing the GUI module and showing the first color in fresh interpreters.
+
+    `deferred_loaded` lists any DEFERRED_MODULES that were imported before
+    the map was shown, which should be none. A timing that could not be
+    taken is None, with the error, or the exit status and stderr of an
+    interpreter that failed, alongside. The interpreters run with a
+    temporary home directory so that leftover autosave journals are not
+    offered for recovery. `sizes` is ignored.
+    '''
+    runs = []
+    with tempfile.TemporaryDirectory() as home:
+        env = dict(os.environ,HOME=home,USERPROFILE=home,MPLBACKEND='Agg')
+        for _ in range(repeat):
+            out = subprocess.run([sys.executable,'-c',_STARTUP_SCRIPT % (DEFERRED_MODULES,)],capture_output=True,text=True,env=env)
+            try:
+                run = json.loads(out.stdout.strip().splitlines()[-1])
+            except (IndexError,ValueError):
+                run = {'import_seconds':None,'first_color_seconds':None,'deferred_loaded':[]}
+            if out.returncode:
+                run['exit_status'] = out.returncode
+                run['stderr'] = out.stderr.strip()
+            runs.append(run)
+    result = {'deferred_loaded':runs[0]['deferred_loaded']}
+    for key in ('import_seconds','first_color_seconds'):
+        times = [r[key] for r in runs if r[key] is not None]
+        result[key] = min(times) if times else None
+    for key in ('import_error','first_color_error','exit_status','stderr'):
+        if result['first_color_seconds'] is None and key in runs[0]:
+            result[key] = runs[0][key]
+    return result
+
+def build(sizes=SIZES, repeat=3) -> dict:
+    '''Time building the full label volumes of each space, and patching them after one more answer.'''
+    from .engine import ColorSpaceMap
+    _warm()
+    results = {}
+    for n in sizes:
+        session = synthetic_session(n)
+        result = {}
+        for space in ('rgb','hsv'):
+            result[f'{space}_seconds'] = _best(lambda m: m.volume(space),repeat,lambda: ColorSpaceMap(session))
+        colormap = ColorSpaceMap(session)
+        colormap.volume('rgb')
+        colormap.volume('hsv')
+        rng = np.random.default_rng(n)
+        def answer():
+            r, g, b = rng.integers(0,256,3)
+            colormap.append(f'#{r:02X}{g:02X}{b:02X}',int(rng.integers(0,12)))
+        result['append_seconds'] = _best(answer,repeat)
+        results[str(n)] = result
+    return results
+
+def sections(sizes=SIZES, repeat=3) -> dict:
+    '''Time the first and a cached cross-section of every view on a lazy map.
+
+    Each space's KD-tree is built first and timed separately, so the section
+    times are those of the plane labelling alone.
+    '''
+    from .engine import ColorSpaceMap, VIEWS
+    _warm()
+    results = {}
+    for n in sizes:
+        colormap = ColorSpaceMap(synthetic_session(n),lazy=True,cache_size=1024)
+        result = {}
+        for space in ('rgb','hsv'):
+            result[f'{space}_tree_seconds'] = _best(lambda: colormap.tree(space),1)
+        for view in VIEWS:
+            # Values far enough apart to fall on different planes of every
+            # view, cycled for long runs with the cached planes dropped.
+            values = cycle(range(5,101,9))
+            def fresh():
+                colormap._sections.clear()
+                return next(values)
+            result[view] = {'first_seconds':_best(lambda v: colormap.section(view,v),repeat,fresh)}
+            # Label the plane once untimed so that only cache hits are timed.
+            colormap.section(view,50)
+            result[view]['cached_seconds'] = _best(lambda: colormap.section(view,50),repeat)
+        results[str(n)] = result
+    return results
+
+def octree(sizes=SIZES, repeat=3) -> dict:
+    '''Time building full-resolution (step 1) maps as octrees, drawing sections and looking colors up in them, and patching them after one more answer.
+
+    Records the number of runs and bytes of each octree next to the size of
+    the dense volume it replaces.
+    '''
+    from .engine import ColorSpaceMap, VIEWS
+    _warm()
+    results = {}
+    rng = np.random.default_rng(0)
+    colors = rng.integers(0,256,size=(1 << 16,3))
+    for n in sizes:
+        colormap = ColorSpaceMap(synthetic_session(n),step=1,adaptive=True)
+        result = {}
+        for space in ('rgb','hsv'):
+            colormap.tree(space)
+            result[space] = {'build_seconds':_best(lambda m: m.octree(space),1,colormap.copy)}
+            octree = colormap.octree(space)
+            result[space].update({'runs':len(octree),'bytes':octree.nbytes,'dense_bytes':int(np.prod(octree.shape))})
+        for view in VIEWS:
+            result[view] = {'section_seconds':_best(lambda: colormap.cached_section(view,50),repeat)}
+        result['lookup_seconds'] = _best(lambda: colormap.classify(colors),repeat)/len(colors)
+        def answer():
+            r, g, b = rng.integers(0,256,3)
+            colormap.append(f'#{r:02X}{g:02X}{b:02X}',int(rng.integers(0,12)))
+        result['append_seconds'] = _best(answer,repeat)
+        results[str(n)] = result
+    return results
+
+def sampling(sizes=SIZES, repeat=3, draws=1000) -> dict:
+    '''Time setting up the samplers for a session of each size and drawing colors from them.
+
+    Draw times are per color, averaged over `draws` draws. For the
+    BoundarySampler the first draw, which finds the boundary cells, is timed
+    on its own.
+    '''
+    from .engine import ColorSpaceMap
+    from .sampling import ColorSampler, BoundarySampler
+    _warm()
+    results = {}
+    for n in sizes:
+        session = synthetic_session(n)
+        result = {'setup_seconds':_best(lambda: ColorSampler(seen=session.rgb,seed=0),repeat)}
+        def draw_many(sampler):
+            for _ in range(draws):
+                sampler.draw()
+        result['draw_seconds'] = _best(draw_many,repeat,lambda: ColorSampler(seen=session.rgb,seed=0))/draws
+        colormap = ColorSpaceMap(session,lazy=True)
+        colormap.tree('rgb')
+        result['boundary_first_seconds'] = _best(lambda s: s.draw(),repeat,lambda: BoundarySampler(colormap,seen=session.rgb,seed=0,explore=0))
+        sampler = BoundarySampler(colormap,seen=session.rgb,seed=0)
+        sampler.draw()
+        result['boundary_draw_seconds'] = _best(lambda: draw_many(sampler),repeat)/draws
+        results[str(n)] = result
+    return results
+
+def io(sizes=SIZES, repeat=3) -> dict:
+    '''Time saving and loading a session in every file format, and record the file sizes.'''
+    from .session import FORMATS, save_session, load_session
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            session = synthetic_session(n)
+            result = {}
+            for suffix in FORMATS:
+                fpath = os.path.join(tmp,f'session{suffix}')
+                entry = {
+                    'save_seconds':_best(lambda: save_session(session,fpath),repeat),
+                    'bytes':os.path.getsize(fpath),
+                    'load_seconds':_best(lambda: load_session(fpath,timed=True),repeat)
+                }
+                if suffix == '.npy':
+                    entry['mmap_load_seconds'] = _best(lambda: load_session(fpath,mmap_mode='r'),repeat)
+                result[suffix[1:]] = entry
+            results[str(n)] = result
+    return results
+
+def render(sizes=SIZES, repeat=3) -> dict:
+    '''Time drawing a section of every view and an axis bar the way the map window does, with Agg.
+
+    Drawing does not depend on the number of answers, so only the smallest
+    of `sizes` is used.
+    '''
+    from matplotlib.colors import ListedColormap
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from .engine import ColorSpaceMap, VIEWS, LABEL_COLORS, COLOR_NAMES, gradient_table, render_section
+    colormap = ColorSpaceMap(synthetic_session(min(sizes)),lazy=True)
+    figure = Figure(dpi=100,figsize=(5,3.5))
+    canvas = FigureCanvasAgg(figure)
+    axes = figure.add_axes((0.0,0.0,1.0,1.0))
+    image = axes.imshow(np.zeros((1,1)),cmap=ListedColormap(LABEL_COLORS),vmin=0,vmax=len(COLOR_NAMES),origin='lower',aspect='auto',interpolation='nearest')
+    canvas.draw()
+    result = {}
+
+    def show(section):
+        h, w = section.shape
+        image.set_data(section)
+        image.set_extent((0,w,0,h))
+        axes.set_xlim(0,w)
+        axes.set_ylim(0,h)
+        canvas.draw()
+
+    for view in VIEWS:
+        section = colormap.section(view,50)
+        result[view] = {
+            'draw_seconds':_best(lambda: show(section),repeat),
+            'png_seconds':_best(lambda: render_section(section),repeat)
+        }
+    bar_figure = Figure(dpi=100,figsize=(5,0.45))
+    bar_canvas = FigureCanvasAgg(bar_figure)
+    bar_axes = bar_figure.add_axes((0.0,0.0,1.0,1.0))
+    bar = bar_axes.imshow(np.zeros((1,1)),origin='lower',aspect='auto',interpolation='nearest')
+    table = gradient_table('h')
+
+    def show_bar():
+        colors = table[50]
+        bar.set_data(colors[None])
+        bar.set_extent((0,len(colors),0,1))
+        bar_axes.set_xlim(0,len(colors))
+        bar_axes.set_ylim(0,1)
+        bar_canvas.draw()
+
+    result['bar_seconds'] = _best(show_bar,repeat)
+    return result
+
+SUITES = {
+    'startup':startup,
+    'build':build,
+    'sections':sections,
+    'octree':octree,
+    'sampling':sampling,
+    'io':io,
+    'render':render
+}
+
+
+def environment() -> dict:
+    '''Describe the interpreter, libraries and machine the benchmarks ran on.'''
+    from . import __version__
+    env = {
+        'colornamespace':__version__,
+        'python':platform.python_version(),
+        'numpy':np.__version__,
+        'platform':platform.platform(),
+        'cpus':os.cpu_count()
+    }
+    for name in ('scipy','matplotlib'):
+        try:
+            env[name] = __import__(name).__version__
+        except ImportError:
+            env[name] = None
+    return env
+
+def _timings(results, prefix=''):
+    # Flatten nested results into {'suite/size/.../name_seconds': seconds}.
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value,dict):
+            flat.update(_timings(value,f'{prefix}{key}/'))
+        elif key.endswith('_seconds') and isinstance(value,(int,float)):
+            flat[prefix+key] = value
+    return flat
+
+def compare(baseline, results, tolerance=0.25) -> dict:
+    '''Return the timings in `results` more than `tolerance` slower than in `baseline`.
+
+    Both are result dicts as printed by main(). The result maps each slower
+    timing's path, such as 'build/1000/hsv_seconds', to (old, new) seconds.
+    '''
+    old = _timings(baseline)
+    new = _timings(results)
+    return {k:(old[k],new[k]) for k in new if k in old and old[k] > 0 and new[k] > old[k]*(1+tolerance)}
+
+def main(argv=None) -> int:
+    from argparse import ArgumentParser
+    parser = ArgumentParser(prog='python -m colornamespace.bench',description='Benchmark colornamespace and print the results as JSON.')
+    parser.add_argument('suites',nargs='*',metavar='suite',help=f'suites to run (default: all of {", ".join(SUITES)})')
+    parser.add_argument('--sizes',type=int,nargs='+',default=SIZES,help='numbers of answers in the synthetic sessions')
+    parser.add_argument('--repeat',type=int,default=3,help='runs per measurement, of which the best is kept (default: 3)')
+    parser.add_argument('--out',default=None,help='also write the results to this file')
+    parser.add_argument('--baseline',default=None,help='results file to compare against; slower timings are listed and fail the run')
+    parser.add_argument('--tolerance',type=float,default=0.25,help='fraction by which a timing may exceed the baseline (default: 0.25)')
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    unknown = [name for name in args.suites if name not in SUITES]
+    if unknown:
+        parser.error(f'unknown suite: {", ".join(unknown)}')
+
+    results = {'environment':environment()}
+    for name in args.suites or SUITES:
+        results[name] = SUITES[name](sizes=args.sizes,repeat=args.repeat)
+    text = json.dumps(results,indent=2)
+    print(text)
+    if args.out:
+        with open(args.out,'w') as out:
+            out.write(text)
+    status = 0
+    # Fail when the GUI cannot be imported or the startup guard is broken so the benchmark can run in CI.
+    if 'startup' in results and (results['startup']['import_seconds'] is None or results['startup']['deferred_loaded']):
+        status = 1
+    if args.baseline:
+        with open(args.baseline) as st:
+            slower = compare(json.load(st),results,args.tolerance)
+        for key, (old, new) in sorted(slower.items()):
+            print(f'{key}: {old:.4g}s -> {new:.4g}s',file=sys.stderr)
+        if slower:
+            status = 1
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+'''Labelling of arbitrary colors, palettes and images with a session's color map.'''
+import os
+from pathlib import Path
+import numpy as np
+from .engine import ColorSpaceMap, LABEL_RGB
+from .session import load_session
+
+# Pixels labelled per task; small enough for the temporaries to stay in cache.
+CHUNK = 1 << 18
+
+# Below this many pixels, querying the KD-tree is cheaper than building the
+# 256^3 lookup table, unless the table already exists.
+LUT_PIXELS = 1 << 23
+
+
+def _pixels(colors):
+    # Returns an (N,3) uint8 array of the colors and the shape of the result.
+    if not isinstance(colors,np.ndarray):
+        from PIL import Image
+        if isinstance(colors,Image.Image):
+            colors = np.asarray(colors.convert('RGB'))
+        else:
+            colors = np.asarray(colors)
+    if colors.shape[-1] != 3:
+        raise ValueError(f'Expected RGB colors in the last axis, not an array of shape {colors.shape}.')
+    if colors.dtype != np.uint8:
+        if colors.size and (colors.min() < 0 or colors.max() > 255):
+            raise ValueError('RGB values must be between 0 and 255.')
+        if colors.dtype.kind not in 'biu' and not np.array_equal(colors,np.round(colors)):
+            raise ValueError('RGB values must be whole numbers; round them before classifying.')
+        colors = colors.astype(np.uint8)
+    return colors.reshape(-1,3), colors.shape[:-1]
+
+def _lookup(table, rgb, out):
+    index = rgb[:,0].astype(np.uint32) << 16
+    index |= rgb[:,1].astype(np.uint32) << 8
+    index |= rgb[:,2]
+    np.take(table,index,out=out)
+
+def classify(colormap, colors, metric=None, lut=None, workers=None, chunk=CHUNK):
+    '''Return the label index a session's map gives every color of `colors`.
+
+    `colormap` is a ColorSpaceMap, a Session or a session file path, and
+    `metric` is passed on when a map has to be built from the latter two.
+    `colors` is an (..., 3) array of whole 0-255 RGB values or a PIL image;
+    floating-point values with a fraction raise ValueError rather than
+    being truncated. The result is a uint8 array of the same shape without
+    its last axis.
+
+    Colors are looked up in the map's 256^3 table when `lut` is true, or by
+    default when the table already exists or there are at least LUT_PIXELS
+    colors; otherwise their nearest samples are queried. Work is split into
+    chunks of `chunk` pixels, run on a pool of `workers` threads (one per
+    CPU by default) if there is more than one chunk.
+    '''
+    if not isinstance(colormap,ColorSpaceMap):
+        if isinstance(colormap,(str,Path)):
+            colormap = load_session(colormap)
+        colormap = ColorSpaceMap(colormap,metric=metric)
+    rgb, shape = _pixels(colors)
+    out = np.empty(len(rgb),dtype=np.uint8)
+    if lut is None:
+        lut = colormap.built('lut') or len(rgb) >= LUT_PIXELS
+    if lut:
+        table = colormap.lut().reshape(-1)
+        def work(i):
+            _lookup(table,rgb[i:i+chunk],out[i:i+chunk])
+    else:
+        # Build the tree up front so the threads only read it.
+        colormap.tree(colormap.metric or 'rgb')
+        def work(i):
+            out[i:i+chunk] = colormap.classify(rgb[i:i+chunk])
+    starts = range(0,len(rgb),chunk)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(starts) < 2:
+        for i in starts:
+            work(i)
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(work,starts))
+    return out.reshape(shape)
+
+def label_image(colormap, image, metric=None, **kwargs):
+    '''Return a PIL image with every pixel of `image` painted in the color of its label.
+
+    Arguments are as for classify().
+    '''
+    from PIL import Image
+    return Image.fromarray(LABEL_RGB[classify(colormap,image,metric,**kwargs)])
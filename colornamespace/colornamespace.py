@@ -2,16 +2,23 @@ import tkinter as tk
 from tkinter import ttk
 from tkinter.filedialog import asksaveasfilename
 from tkinter.messagebox import askokcancel, showerror
-from tkinter.filedialog import askopenfilename
+from tkinter.filedialog import askopenfilename, askopenfilenames
 from pathlib import Path
-from colorsys import hsv_to_rgb, rgb_to_hsv
-from numpy import array, meshgrid, squeeze
-from scipy.interpolate import NearestNDInterpolator
-from itertools import product
+import subprocess
+import sys
+from queue import Queue, Empty
+import threading
+from time import time, perf_counter, perf_counter_ns
+from numpy import ma, zeros
 from random import randint
 from PIL import ImageTk, Image
+from .engine import ColorSpaceMap, BuildCancelled, COLOR_NAMES, LABEL_COLORS, VIEWS, GRADIENTS, gradient_table, section_colors, section_index
+from .sampling import ColorSampler, BoundarySampler, START_COLORS
+from .session import Session, FileReadError, load_session, save_session
+from .journal import Journal, discard_journal, find_journals, new_journal_path, replay_journal
+from .profiling import PROFILER
+from .store import MapStore
 
-__fixedcolors = product((0,5,15,178,240,250,255),repeat=3)
 BG = '#444444'
 FG = '#FFFFFF'
 
@@ -47,78 +54,59 @@ def randomcolor() -> str:
     return f'#{r:02X}{g:02X}{b:02X}'
 
 def get_color(old_colors=[]) -> str:
-    '''Select a color at random from __fixedcolors or select a random color'''
-    remcolors = [c for c in __fixedcolors if c not in old_colors]
-    if len(remcolors) > 1:
-        r,g,b = remcolors[randint(0,len(remcolors)-1)]
-        return f'#{r:02X}{g:02X}{b:02X}'
-    elif len(remcolors) == 1:
-        return remcolors[0]
-    else:
-        return randomcolor()
+    '''Select a color at random from the fixed palette or select a random color'''
+    return ColorSampler(seen=old_colors).draw()
     
 
-class FileReadError(Exception):
-    '''Error returned when file exists but could not be correctly parsed.'''
-    def __init__(self, *args: object, filename=None) -> None:
-        super().__init__(*args)
-        self.filename = filename
-
 class ColorNameMapper(tk.Tk):
     def __init__(self, *args, **kwargs) -> None:
-        from matplotlib.colors import ListedColormap
-        from itertools import product
         super().__init__(*args,**kwargs)
         self.saved = True
         self.display_index = -1
         self.currentpath = None
-        self.colormap = ListedColormap([[1,0,0,1],[1,0,0.5,1],[1,0.25,0,1],[1,1,0,1],[0,1,0,1],[0,0,1,1],[0.6,0,0.6,1],[0.5,0.25,0,1],[0.5,0.5,0.5,1],[0,0,0,1],[1,1,1,1],[0.25,0.25,0.25,1]])
-        self.colorstart = [f'#{r:02X}{g:02X}{b:02X}' for r,g,b in product((0,5,35,63,122,185,220,250,255),repeat=3)]
-        self.color_names = ['Red','Pink','Orange','Yellow','Green','Blue','Purple','Brown','Gray','Black','White','None']
+        self.colormap = None
+        self.colorstart = [f'#{r:02X}{g:02X}{b:02X}' for r,g,b in START_COLORS]
+        self.color_names = list(COLOR_NAMES)
         self.plottype = tk.Variable(self,value='Saturation-Hue')
         self.plotsettings = {'Saturation-Hue':(99,99),'Value-Hue':(99,99),'Green-Red':(0,255),'Blue-Red':(0,255),'Blue-Green':(0,255)}
-        self._cross_section = tk.IntVar(self,value=self.plotsettings[self.plottype.get()][0])
-        self._data = []
-        self._datamap = None 
-        self._datamap_is_old = False
-        self._axesmaps = {
-            'h':[
-                lambda v: ListedColormap([hsv_to_rgb(float(h)/360.0,1,float(v)/100.0) for h in range(360)]),
-                360
-            ],
-            's':[
-                lambda v: ListedColormap([hsv_to_rgb(0,float(s)/100.0,float(v)/100.0) for s in range(100)]),
-                100
-            ],
-            'v':[
-                lambda s: ListedColormap([hsv_to_rgb(0,float(s)/100.0,float(v)/100.0) for v in range(100)]),
-                100
-            ],
-            'r':[
-                lambda b: ListedColormap([(float(r)/255.0,0,float(b)/255.0) for r in range(256)]),
-                256
-            ],
-            'g':[
-                lambda b: ListedColormap([(0,float(g)/255.0,float(b)/255.0) for g in range(256)]),
-                256
-            ],
-            'b':[
-                lambda g: ListedColormap([(0,float(g)/255.0,float(b)/255.0) for b in range(256)]),
-                256
-            ],
-            'b2':[
-                lambda r: ListedColormap([(float(r)/255.0,0,float(b)/255.0) for b in range(256)]),
-                256
-            ],
-            'g2':[
-                lambda r: ListedColormap([(float(r)/255.0,float(g)/255.0,0) for g in range(256)]),
-                256
-            ],
-            'r2':[
-                lambda g: ListedColormap([(float(r)/255.0,float(g)/255.0,0) for r in range(256)]),
-                256
-            ]
+        self._plotaxes = {
+            'Saturation-Hue':('h','s','Value %:'),
+            'Value-Hue':('h','v','Saturation %:'),
+            'Green-Red':('r','g','Blue %:'),
+            'Blue-Red':('r2','b','Green %:'),
+            'Blue-Green':('g2','b2','Red %:')
         }
+        self._cross_section = tk.IntVar(self,value=self.plotsettings[self.plottype.get()][0])
+        self._data = Session(timed=True)
+        self._shown_at = perf_counter()
+        self._map = ColorSpaceMap(lazy=True)
+        self._target_boundaries = tk.BooleanVar(self,value=False)
+        self._metric = tk.StringVar(self,value='')
+        self._full_resolution = tk.BooleanVar(self,value=False)
+        self._sampler = self._new_sampler()
+        self._revision = 0
+        self._map_revision = 0
+        self._map_queue = Queue()
+        self._map_cancel = threading.Event()
+        self._map_thread = None
+        self._map_pending = False
+        self._patch_queue = Queue()
+        self._patching = False
+        self._patch_ops = []
+        self._plotframe = None
+        self._comparison = None
+        self._pair = (0,1)
+        self._show_differences = tk.BooleanVar(self,value=False)
+        self._consensus = None
+        self._show_consensus = tk.BooleanVar(self,value=False)
+        self._profiling = tk.BooleanVar(self,value=PROFILER.enabled)
+        self._perfwindow = None
+        self._map_requested = None
+        self._store = None
+        try:
+            self._journal = Journal(new_journal_path())
+        except OSError:
+            self._journal = None
         self.title('Color Name Mapper')
         self.config(bg=BG)
 
@@ -126,13 +114,20 @@ class ColorNameMapper(tk.Tk):
 
         self._init_controls()
 
-        self._init_display()
-
         tk.Frame(self,bg=BG).grid(row=6,column=0,sticky='news')
         self.rowconfigure(5,weight=6)
         self.rowconfigure(1,weight=1)
         self.columnconfigure(1,weight=1)
         self._new_color()
+        self.after_idle(self._recover)
+        self.after(1000,self._sync_journal)
+
+    def destroy(self):
+        if self._journal is not None:
+            self._journal.close(remove=self.saved)
+            self._journal = None
+        self._use_store(None)
+        super().destroy()
     
     def _init_menu(self):
         self._menubar = tk.Menu(self,bg='#555555')
@@ -148,6 +143,10 @@ class ColorNameMapper(tk.Tk):
         self._filemenu.add_command(label='Load Session',command=self._openfile)
         self._filemenu.add_command(label='Save Session',command=self._save,state='disabled')
         self._filemenu.add_command(label='Save As...',command=self._saveas)
+        self._filemenu.add_command(label='Compare Sessions...',command=self._compare)
+        self._filemenu.add_command(label='Consensus Map...',command=self._open_consensus)
+        self._filemenu.add_command(label='Label Image...',command=self._label_image)
+        self._filemenu.add_command(label='New Window',command=self._new_window)
         self._filemenu.add_separator()
         self._filemenu.add_command(label='Save Plot',state='disabled')
         self._filemenu.add_command(label='Save Report',state='disabled')
@@ -157,9 +156,22 @@ class ColorNameMapper(tk.Tk):
         
         self._editmenu.add_command(label='Undo',command=self._undo)
         self._editmenu.add_command(label='Show Plot',command=self._show_plot)
+        self._editmenu.add_checkbutton(label='Target Boundaries',variable=self._target_boundaries,command=self._switch_sampler)
+        self._editmenu.add_checkbutton(label='Show Consensus',variable=self._show_consensus,command=self._toggle_consensus,state='disabled')
+        self._editmenu.add_checkbutton(label='Show Differences',variable=self._show_differences,command=self._toggle_differences,state='disabled')
+        self._metricmenu = tk.Menu(self._editmenu)
+        self._metricmenu.add_radiobutton(label='Map Coordinates',variable=self._metric,value='',command=self._switch_metric)
+        self._metricmenu.add_radiobutton(label='OKLab',variable=self._metric,value='oklab',command=self._switch_metric)
+        self._metricmenu.add_radiobutton(label='CIELAB',variable=self._metric,value='cielab',command=self._switch_metric)
+        self._editmenu.add_cascade(label='Color Distance',menu=self._metricmenu)
+        self._editmenu.add_checkbutton(label='Full Resolution',variable=self._full_resolution,command=self._switch_resolution)
 
         self._helpmenu.add_command(label='About',state='disabled')
         self._helpmenu.add_command(label='Instructions',state='disabled')
+        self._helpmenu.add_separator()
+        self._helpmenu.add_checkbutton(label='Record Timings',variable=self._profiling,command=self._toggle_profiling)
+        self._helpmenu.add_command(label='Performance...',command=self._show_performance)
+        self._helpmenu.add_command(label='Export Trace...',command=self._export_trace)
 
         self.config(menu=self._menubar)
 
@@ -250,9 +262,16 @@ class ColorNameMapper(tk.Tk):
         self._showplotbutton.pack(side='left',anchor='w',padx=8)
     
     def _init_display(self):
+        # Deferred until the map is first shown so startup only loads Tk and PIL.
+        from matplotlib.colors import ListedColormap
         from matplotlib.figure import Figure
         from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
+        # Cyan, which no label uses, marks the cells a compared pair names differently.
+        self.colormap = ListedColormap(LABEL_COLORS).with_extremes(bad='cyan')
+        # One RGBA table per axis bar, indexed by cross-section percentage.
+        self._axesmaps = {name:gradient_table(name) for name in GRADIENTS}
+
         self._plotframe = tk.Frame(self,width=300,height=500,bg=BG)
 
         w = 5
@@ -284,6 +303,20 @@ class ColorNameMapper(tk.Tk):
         self._ycolor.set_yticks([])
         self._ycolor.set_xbound(0,1)
         self._ycolor.set_ybound(0,100)
+        # The images are created once and only get new data on each redraw.
+        self._mapimage = self._axes.imshow(zeros((1,1)),cmap=self.colormap,vmin=0,vmax=len(self.color_names),origin='lower',aspect='auto',interpolation='nearest',visible=False)
+        self._ximage = self._xcolor.imshow(zeros((1,1)),origin='lower',aspect='auto',interpolation='nearest',visible=False)
+        self._yimage = self._ycolor.imshow(zeros((1,1)),origin='lower',aspect='auto',interpolation='nearest',visible=False)
+        self._shown_bars = {}
+        self._shown_section = None
+        self._peek_colors = None
+        self._peek_at = None
+        self._peek_job = None
+        self._peek_shown = None
+        # Idle redraws call draw() on the canvas, so wrapping it times every redraw.
+        self._displaycanvas.draw = PROFILER.wrap('draw_map',self._displaycanvas.draw)
+        self._xcanvas.draw = PROFILER.wrap('draw_xbar',self._xcanvas.draw)
+        self._ycanvas.draw = PROFILER.wrap('draw_ybar',self._ycanvas.draw)
         self._displaycanvas.draw()
         self._xcanvas.draw()
         self._ycanvas.draw()
@@ -305,6 +338,10 @@ class ColorNameMapper(tk.Tk):
         self._cross_section_select = ttk.Spinbox(self._plot_controls,justify='center',format='%3.0f',from_=0,to=100,command=self._display_map,textvariable=self._cross_section,width=8)
         self._cross_section_select.bind_all('<Return>',self._display_map)
         self._cross_section_select.pack(side='left',anchor='w',padx=2,pady=4)
+        self._map_status = tk.Label(self._plot_controls,justify='left',text='',fg=FG,bg=BG)
+        self._map_status.pack(side='left',anchor='w',padx=6,pady=4)
+        self._colorpeek_name = tk.Label(self._plot_controls,justify='right',text='',fg=FG,bg=BG)
+        self._colorpeek_name.pack(side='right',anchor='e',padx=6,pady=4)
 
         self._plot_controls.grid(row=2,column=0,columnspan=2,sticky='ew',pady=3)
 
@@ -315,11 +352,28 @@ class ColorNameMapper(tk.Tk):
 
     
     def _record_choice(self,idx):
+        with PROFILER.span('record_choice'):
+            self._record(idx)
+        PROFILER.count('answers')
+
+    def _record(self,idx):
+        in_sync = self._map_revision == self._revision
+        self._use_store(None)
         if self.display_index == -1:
-            self._data.append((self._current_color,idx))
+            answered, response_time = time(), perf_counter()-self._shown_at
+            self._data.append(self._current_color,idx,time=answered,response_time=response_time)
+            self._log('append',self._current_color,idx,time=answered,response_time=response_time)
+            if in_sync:
+                self._change_map('append',self._current_color,idx)
         else:
-            self._data[self.display_index] = (self._data[self.display_index][0],idx)
-        self._datamap_is_old = True
+            self._data.relabel(self.display_index,idx)
+            self._log('relabel',self.display_index,idx)
+            if in_sync:
+                self._change_map('relabel',self.display_index,idx)
+        self._revision += 1
+        self._cancel_map()
+        if in_sync:
+            self._map_revision = self._revision
         self.saved = False
         self._savedatabutton.config(state='normal')
         self._filemenu.entryconfig(3,state='normal')
@@ -327,11 +381,85 @@ class ColorNameMapper(tk.Tk):
         self._new_color()
         if self.display_index == (len(self._data)-1):
             self._review(-1)
+        if self._plotframe is not None and self._plotframe.winfo_ismapped():
+            self._display_map()
             
     
+    def _change_map(self,method,*args):
+        # Patching the built volumes rebuilds a KD-tree, solves linear
+        # programs and relabels boxes of the LUT, too slow for the Tk thread.
+        # A copy taken before the change is patched on a worker instead, and
+        # changes made meanwhile are queued behind it.
+        if self._patching:
+            self._patch_ops.append((method,args))
+        else:
+            self._start_patch(self._map.copy(),[(method,args)])
+        getattr(self._map,method)(*args,patch=False)
+
+    def _start_patch(self,snapshot,ops):
+        self._patching = True
+        threading.Thread(target=self._patch_worker,args=(snapshot,ops),daemon=True).start()
+        self.after(20,self._poll_patch)
+
+    def _patch_worker(self,snapshot,ops):
+        try:
+            for method, args in ops:
+                getattr(snapshot,method)(*args)
+            self._patch_queue.put((snapshot,None))
+        except Exception as err:
+            self._patch_queue.put((snapshot,err))
+
+    def _poll_patch(self):
+        try:
+            snapshot, err = self._patch_queue.get_nowait()
+        except Empty:
+            self.after(20,self._poll_patch)
+            return
+        self._patching = False
+        if err is None and self._patch_ops:
+            ops, self._patch_ops = self._patch_ops, []
+            self._start_patch(snapshot,ops)
+            return
+        self._patch_ops = []
+        merged = err is None and self._map.merge(snapshot)
+        if self._map_pending:
+            dispmap = self._map.cached_section(self.plottype.get(),self._cross_section.get()) if merged else None
+            if dispmap is None:
+                self._request_map()
+            else:
+                self._map_status.config(text='')
+                self._draw_section(dispmap)
+
+    def _new_sampler(self,seen=()):
+        if self._target_boundaries.get():
+            return BoundarySampler(self._map,seen=seen)
+        return ColorSampler(seen=seen)
+
+    def _switch_sampler(self):
+        self._sampler = self._new_sampler(self._data.rgb)
+        self._sampler.mark([self._current_color])
+
+    def _switch_metric(self):
+        self._cancel_map()
+        self._map.set_metric(self._metric.get() or None)
+        self._share('adopt')
+        if self._plotframe is not None and self._plotframe.winfo_ismapped():
+            self._display_map()
+
+    def _switch_resolution(self):
+        # Full resolution has a cell for every color; the whole map is then
+        # kept as an octree, which stays small where the labels are uniform.
+        self._cancel_map()
+        full = self._full_resolution.get()
+        self._map.set_step(1 if full else 2,adaptive=full)
+        self._share('adopt')
+        if self._plotframe is not None and self._plotframe.winfo_ismapped():
+            self._display_map()
+
     def _new_color(self):
         if self.display_index == -1:
-            self._current_color = get_color([a for *a,_ in self._data])
+            self._current_color = self._sampler.draw()
+            self._shown_at = perf_counter()
             self._colordisplay.config(bg=self._current_color)
         else:
             self._review(dir=0)
@@ -381,14 +509,21 @@ class ColorNameMapper(tk.Tk):
             resp = askokcancel('Save Session?',"The current session has not been saved. If you continue, any unsaved answers will be lost. Continue?")
             if not resp:
                 return
-        self._data = []
+        self._data = Session(timed=True)
+        self._sampler = self._new_sampler()
+        self._revision += 1
+        self._cancel_map()
+        self._build_map()
+        self._use_store(None)
+        self._log('reset',None)
         self.currentpath = None 
         self.saved = True
         self._savedatabutton.config(state='disabled')
         self._filemenu.entryconfig(3,state='disabled')
         self._new_color()
         self._update_count()
-        self._clear_map()
+        if self._plotframe is not None:
+            self._clear_map()
     
     def _undo(self):
         if self.display_index==-1:
@@ -398,7 +533,9 @@ class ColorNameMapper(tk.Tk):
         self._update_count()
     
     def _saveas(self):
-        fpath = asksaveasfilename(parent=self,title='Save Color Map',initialdir='~/Documents',filetypes=[('JSON','*.json'),('Text','*.txt'),('CSV','*.csv')],defaultextension='.txt')
+        fpath = asksaveasfilename(parent=self,title='Save Color Map',initialdir='~/Documents',filetypes=[('JSON','*.json'),('Text','*.txt'),('CSV','*.csv'),('NumPy','*.npy')],defaultextension='.txt')
+        if not fpath:
+            return
         fpath = Path(fpath)
         if fpath.exists():
             answ = askokcancel(title="File Exists",message=f"The file {fpath.name} already exists. Are you sure you want to replace it?")
@@ -427,37 +564,24 @@ class ColorNameMapper(tk.Tk):
                 showerror('Save Error',f'Error! The file could not be saved.\n{msg}')
 
     def _save_to(self,fpath):
-        from json import dumps
-        if fpath.suffix=='.json':
-            d = {}
-            for c,l in self._data:
-                if c in d.keys():
-                    d[c] += [self.color_names[l]]
-                else:
-                    d[c] = [self.color_names[l]]
-            d = dumps(d)
-            with fpath.open('w') as out:
-                out.write(d)
-        elif fpath.suffix=='.txt':
-            d = '\n'.join([':'.join([c,self.color_names[i]]) for c,i in self._data])
-            with fpath.open('w') as out:
-                out.write(d)
-        elif fpath.suffix=='.csv':
-            pass
-            d = [['r','g','b','idx','color']]
-            for c,i in self._data:
-                d += [[int(c[1:3],base=16),int(c[3:5],base=16),int(c[5:7],base=16),i,self.color_names[i]]]
-            with fpath.open('w') as out:
-                out.write('\n'.join([','.join([str(b) for b in a]) for a in d]))
+        with PROFILER.span('save',format=Path(fpath).suffix,answers=len(self._data)):
+            save_session(self._data,fpath)
+        self._use_store(None)
+        # A JSON file reorders the answers, so the journal needs the session as saved.
+        self._log('reset',fpath,self._data)
         self.saved = True
         self._savedatabutton.config(state='disabled')
         self._filemenu.entryconfig(3,state='disabled')
         self.currentpath = fpath
     
-    def _openfile(self):
+    def open_session(self,fpath):
+        '''Open a session file, as File → Load Session does, reporting any error in a dialog.'''
+        self._openfile(fpath)
+
+    def _openfile(self,f=None):
         msg = None
         try:
-            self._open()
+            self._open(f)
         except FileNotFoundError as err:
             if len(err.args) > 0:
                 msg = err.args[0]
@@ -473,42 +597,361 @@ class ColorNameMapper(tk.Tk):
         if msg is not None:
             showerror('Save Error',f'Error! The file could not be saved.\n{msg}')
     
-    def _open(self):
-        from json import loads, JSONDecodeError
-        f = askopenfilename(parent=self,title='Open Color Map',initialdir='~/Documents',filetypes=[('JSON','*.json'),('Text','*.txt'),('CSV','*.csv')],defaultextension='.txt')
+    def _open(self,f=None):
+        if f is None:
+            f = askopenfilename(parent=self,title='Open Color Map',initialdir='~/Documents',filetypes=[('JSON','*.json'),('Text','*.txt'),('CSV','*.csv'),('NumPy','*.npy')],defaultextension='.txt')
+        if not f:
+            return
         f = Path(f)
-        try:
-            with f.open('r') as st:
-                d = st.read()
-            if f.suffix=='.json':
-                d = loads(d)
-                d = [(k,v) for k,v in d.items()]
-                if all(len(v)==1 and hasattr(v[0],'lower') for _,v in d):
-                    d = [(k,self.color_names.index(v[0])) for k,v in d]
-            elif f.suffix=='.txt':
-                d = [a.split(':') for a in d.split('\n') if not a.startswith('%')]
-                d = [(a,int(b)) for a,b in d]
-            elif f.suffix=='.csv':
-                d = d.split('\n')
-                d = [[int(q) for q in a.split(',')[:-1]] for a in d[1:]]
-                d = [(f'#{r:02X}{g:02X}{b:02X}',i) for r,g,b,i,*_ in d]
-            assert all(k.startswith('#') for k,v in d)
-            assert all(v >= 0 and v < len(self.color_names) and v==round(v) for _,v in d)
-        except JSONDecodeError as err:
-            raise FileReadError(f'Could not read JSON file: {err.msg}',filename=f.absolute()) from None
-        except (ValueError,TypeError,AssertionError):
-            raise FileReadError(f'Invalid data encountered in {f.suffix.capitalize()[1:]} file.',filename=f.absolute()) from None
-        else:
-            self._data = d
-            self._update_count()
-            self._new_color()
+        with PROFILER.span('open',format=f.suffix):
+            # Windows that open the same file share its samples and volumes.
+            try:
+                store = MapStore.for_file(f)
+                store.acquire()
+            except OSError:
+                store = None
+            try:
+                if store is not None and store.has_session():
+                    d = store.session()
+                else:
+                    d = load_session(f,timed=True)
+                    if store is not None:
+                        try:
+                            store.publish_session(d)
+                            # Read back the published copy so the samples are held only once.
+                            d = store.session()
+                        except OSError:
+                            store.release()
+                            store = None
+            except BaseException:
+                if store is not None:
+                    store.release()
+                raise
+            self._set_session(d)
+            self._use_store(store)
+            self._share('adopt')
+        self._log('reset',f)
         self.saved = True
         self._savedatabutton.config(state='disabled')
         self._filemenu.entryconfig(3,state='disabled')
         self.currentpath = f
-        self._datamap_is_old = True
-    
+
+    def _share(self,method):
+        # Sharing is an optimisation: if the store fails, carry on without it.
+        if self._store is None:
+            return
+        try:
+            getattr(self._store,method)(self._map)
+        except OSError:
+            self._use_store(None)
+
+    def _use_store(self,store):
+        # The last window to release a store deletes it, freeing its memory.
+        if self._store is not None and self._store is not store:
+            try:
+                self._store.release()
+            except OSError:
+                pass
+        self._store = store
+
+    def _new_window(self):
+        # A separate process keeps both windows responsive; they share
+        # memory through the store of the file they show.
+        args = [sys.executable,'-m','colornamespace']
+        if self.currentpath is not None:
+            args.append(str(self.currentpath))
+        subprocess.Popen(args)
+
+    def _set_session(self,d):
+        self._use_store(None)
+        self._data = d
+        self._map.set_data(d)
+        self._revision += 1
+        self._map_revision = self._revision
+        self._cancel_map()
+        self._sampler = self._new_sampler(d.rgb)
+        self._review(-1)
+        self._new_color()
+
+    def _log(self,method,*args,**kwargs):
+        if self._journal is None:
+            return
+        try:
+            getattr(self._journal,method)(*args,**kwargs)
+        except OSError as err:
+            self._journal = None
+            showerror('Autosave Error',f'Autosave has been turned off because the journal could not be written.\n{err}')
+
+    def _sync_journal(self):
+        self._log('sync')
+        self.after(1000,self._sync_journal)
+
+    def _recover(self):
+        for fpath in find_journals():
+            try:
+                d, base, changes = replay_journal(fpath)
+            except FileReadError:
+                # Keep an unreadable journal out of the way instead of offering it at every start.
+                try:
+                    fpath.replace(fpath.with_name(fpath.name + '.unreadable'))
+                except OSError:
+                    pass
+                continue
+            if changes == 0 or (base is None and len(d) == 0):
+                discard_journal(fpath)
+                continue
+            if base is None:
+                message = f'{len(d)} answers from a new session were not saved when the program last closed. Recover them?'
+            else:
+                message = f'{changes} changes to {Path(base).name} were not saved when the program last closed. Recover them?'
+            if not askokcancel('Recover Session?',message):
+                discard_journal(fpath)
+                continue
+            self._set_session(d)
+            if self._journal is not None:
+                self._journal.close(remove=True)
+            try:
+                self._journal = Journal.resume(fpath)
+            except OSError:
+                self._journal = None
+            self.saved = False
+            self._savedatabutton.config(state='normal')
+            self._filemenu.entryconfig(3,state='normal')
+            self.currentpath = None if base is None else Path(base)
+            return
+
+    def _compare(self):
+        files = askopenfilenames(parent=self,title='Compare Sessions',initialdir='~/Documents',filetypes=[('JSON','*.json'),('Text','*.txt'),('CSV','*.csv'),('NumPy','*.npy')])
+        if not files:
+            return
+        from .compare import SessionComparison
+        sessions = [Path(f) for f in files]
+        names = [f.stem for f in sessions]
+        if len(self._data) > 0:
+            # The worker gets a copy, as answers can still be given while it runs.
+            sessions.insert(0,Session.from_arrays(self._data.rgb,self._data.labels))
+            names.insert(0,'Current')
+        if len(sessions) < 2:
+            showerror('Compare Error','Choose at least two sessions to compare.')
+            return
+        space = VIEWS[self.plottype.get()][0]
+        self._run_task('Comparing Sessions',lambda progress: SessionComparison(sessions,names,space=space,progress=progress),self._compared,'Compare Error','Error! The sessions could not be compared.')
+
+    def _compared(self,comparison):
+        self._comparison = comparison
+        self._pair = (0,1)
+        self._editmenu.entryconfig('Show Differences',state='normal')
+        if self._show_differences.get():
+            self._display_map()
+        self._show_comparison(comparison)
+
+    def _show_comparison(self,comparison):
+        window = tk.Toplevel(self,bg=BG)
+        window.title(f'Session Agreement ({comparison.space.upper()})')
+        # Columns are named by position since two sessions can share a name.
+        columns = [f'c{i}' for i in range(len(comparison.names))]
+        table = ttk.Treeview(window,columns=columns,height=len(comparison))
+        table.heading('#0',text='')
+        table.column('#0',width=120)
+        for column, name in zip(columns,comparison.names):
+            table.heading(column,text=name)
+            table.column(column,width=80,anchor='center')
+        for name, row in zip(comparison.names,comparison.agreement_matrix()):
+            table.insert('','end',text=name,values=[f'{100*a:.1f}%' for a in row])
+        table.pack(fill='both',expand=True,padx=5,pady=5)
+        tk.Label(window,text='Percentage of the map each pair of sessions names the same.',fg=FG,bg=BG).pack(padx=5,pady=4)
+
+        pair = tk.Frame(window,bg=BG)
+        first = ttk.Combobox(pair,state='readonly',values=comparison.names,width=14)
+        second = ttk.Combobox(pair,state='readonly',values=comparison.names,width=14)
+        first.current(self._pair[0])
+        second.current(self._pair[1])
+        tk.Label(pair,text='Compare',fg=FG,bg=BG).pack(side='left',padx=2)
+        first.pack(side='left',padx=2)
+        tk.Label(pair,text='with',fg=FG,bg=BG).pack(side='left',padx=2)
+        second.pack(side='left',padx=2)
+        tk.Button(pair,text='Show Differences',bg=BG,fg=FG,command=self._show_pair).pack(side='left',padx=8)
+        pair.pack(padx=5,pady=4)
+
+        columns = [f'c{i}' for i in range(len(self.color_names))]
+        confusion = ttk.Treeview(window,columns=columns,height=len(self.color_names))
+        confusion.column('#0',width=120)
+        for column, name in zip(columns,self.color_names):
+            confusion.column(column,width=55,anchor='e')
+        confusion.pack(fill='both',expand=True,padx=5,pady=5)
+        tk.Label(window,text='Percentage of the map named by the row label in the first session and the column label in the second.',fg=FG,bg=BG,wraplength=600).pack(padx=5,pady=4)
+
+        def select(event=None):
+            if comparison is not self._comparison:
+                return
+            self._pair = (first.current(),second.current())
+            self._fill_confusion(confusion,comparison,*self._pair)
+            if self._show_differences.get() and self._plotframe is not None and self._plotframe.winfo_ismapped():
+                self._display_map()
+        first.bind('<<ComboboxSelected>>',select)
+        second.bind('<<ComboboxSelected>>',select)
+        self._fill_confusion(confusion,comparison,*self._pair)
+
+    def _fill_confusion(self,table,comparison,i,j):
+        names = comparison.names
+        table.heading('#0',text=f'{names[i]} vs {names[j]}')
+        for column, name in zip(table['columns'],self.color_names):
+            table.heading(column,text=name)
+        table.delete(*table.get_children())
+        counts = comparison.confusion(i,j)
+        total = max(int(counts.sum()),1)
+        for name, row in zip(self.color_names,counts):
+            table.insert('','end',text=name,values=[f'{100*c/total:.1f}' if c else '' for c in row])
+
+    def _show_pair(self):
+        self._show_differences.set(True)
+        self._show_consensus.set(False)
+        if self._plotframe is None or not self._plotframe.winfo_ismapped():
+            self._show_plot()
+        self._map_status.config(text='')
+        self._display_map()
+
+    def _toggle_differences(self):
+        # Differences and the consensus both replace the session's own map, so only one is shown.
+        if self._show_differences.get():
+            self._show_consensus.set(False)
+        if self._plotframe is not None:
+            self._map_status.config(text='')
+            self._display_map()
+
+    def _run_task(self,title,work,done,error_title,error_message,unit='sessions'):
+        # Runs work(progress) on a worker thread behind a progress window,
+        # then passes its result to done() on the Tk thread. progress(done,
+        # total) counts `unit` and raises BuildCancelled once Cancel is pressed.
+        window = tk.Toplevel(self,bg=BG)
+        window.title(title)
+        window.transient(self)
+        bar = ttk.Progressbar(window,length=300,mode='determinate')
+        bar.pack(padx=10,pady=10)
+        status = tk.Label(window,text='Starting...',fg=FG,bg=BG)
+        status.pack(padx=10)
+        cancel = threading.Event()
+        tk.Button(window,text='Cancel',command=cancel.set,bg=BG,fg=FG).pack(pady=6)
+        window.protocol('WM_DELETE_WINDOW',cancel.set)
+        results = Queue()
+        def progress(count,total):
+            if cancel.is_set():
+                raise BuildCancelled()
+            results.put(('progress',(count,total)))
+        def run():
+            try:
+                results.put(('done',work(progress)))
+            except BuildCancelled:
+                results.put(('cancelled',None))
+            except Exception as err:
+                results.put(('error',err))
+        threading.Thread(target=run,daemon=True).start()
+        self.after(50,self._poll_task,window,bar,status,results,done,error_title,error_message,unit)
+
+    def _poll_task(self,window,bar,status,results,done,error_title,error_message,unit):
+        while True:
+            try:
+                kind, value = results.get_nowait()
+            except Empty:
+                break
+            if kind == 'progress':
+                count, total = value
+                bar.config(maximum=total,value=count)
+                status.config(text=f'{count} of {total} {unit}')
+                continue
+            window.destroy()
+            if kind == 'done':
+                done(value)
+            elif kind == 'error':
+                showerror(error_title,f'{error_message}\n{value}')
+            return
+        self.after(50,self._poll_task,window,bar,status,results,done,error_title,error_message,unit)
+
+    def _open_consensus(self):
+        files = askopenfilenames(parent=self,title='Consensus Map',initialdir='~/Documents',filetypes=[('JSON','*.json'),('Text','*.txt'),('CSV','*.csv'),('NumPy','*.npy')])
+        if not files:
+            return
+        from .consensus import build_consensus
+        space = VIEWS[self.plottype.get()][0]
+        self._run_task('Building Consensus',lambda progress: build_consensus(files,space=space,workers=1,progress=progress),self._consensus_built,'Consensus Error','Error! The consensus map could not be built.')
+
+    def _consensus_built(self,consensus):
+        self._consensus = consensus
+        self._editmenu.entryconfig('Show Consensus',state='normal')
+        self._show_consensus.set(True)
+        self._show_differences.set(False)
+        if self._plotframe is None or not self._plotframe.winfo_ismapped():
+            self._show_plot()
+        self._display_map()
+
+    def _label_image(self):
+        f = askopenfilename(parent=self,title='Label Image',initialdir='~/Pictures',filetypes=[('Images','*.png *.jpg *.jpeg *.bmp *.gif *.tif *.tiff'),('All Files','*')])
+        if not f:
+            return
+        out = asksaveasfilename(parent=self,title='Save Labelled Image',initialdir=Path(f).parent,initialfile=f'{Path(f).stem}_labels.png',filetypes=[('PNG','*.png')],defaultextension='.png')
+        if not out:
+            return
+        from .classifier import label_image
+        if self._map_revision != self._revision:
+            self._build_map()
+        colormap = self._map.copy()
+        def work(progress):
+            progress(0,1)
+            labelled = label_image(colormap,Image.open(f))
+            progress(1,1)
+            labelled.save(out)
+            return colormap
+        # The table or tree built for the image is kept if the map has not changed since.
+        self._run_task('Labelling Image',work,self._map.merge,'Label Error','Error! The image could not be labelled.',unit='images')
+
+    def _toggle_profiling(self):
+        PROFILER.enabled = self._profiling.get()
+
+    def _show_performance(self):
+        if self._perfwindow is not None and self._perfwindow.winfo_exists():
+            self._perfwindow.lift()
+            return
+        window = self._perfwindow = tk.Toplevel(self,bg=BG)
+        window.title('Performance')
+        columns = ('calls','total','mean','max','last')
+        table = ttk.Treeview(window,columns=columns,height=14)
+        table.heading('#0',text='Phase')
+        table.column('#0',width=140)
+        for name in columns:
+            table.heading(name,text=name.capitalize() if name == 'calls' else f'{name.capitalize()} (ms)')
+            table.column(name,width=80,anchor='e')
+        table.pack(fill='both',expand=True,padx=5,pady=5)
+        status = tk.Label(window,text='',fg=FG,bg=BG)
+        status.pack(side='left',padx=5,pady=4)
+        tk.Button(window,text='Export Trace...',command=self._export_trace,bg=BG,fg=FG).pack(side='right',padx=5,pady=4)
+        tk.Button(window,text='Clear',command=PROFILER.clear,bg=BG,fg=FG).pack(side='right',padx=5,pady=4)
+        self._refresh_performance(table,status)
+
+    def _refresh_performance(self,table,status):
+        # Redraws the table twice a second until the window is closed.
+        if not table.winfo_exists():
+            return
+        table.delete(*table.get_children())
+        stats = PROFILER.stats()
+        for name in sorted(stats,key=lambda n: stats[n]['total'],reverse=True):
+            s = stats[name]
+            table.insert('','end',text=name,values=[s['calls']]+[f'{1000*s[k]:.1f}' for k in ('total','mean','max','last')])
+        counters = ', '.join(f'{k}: {v}' for k,v in sorted(PROFILER.counters().items()))
+        status.config(text=counters if PROFILER.enabled else 'Recording is off. Turn on Help → Record Timings.')
+        self.after(500,self._refresh_performance,table,status)
+
+    def _export_trace(self):
+        fpath = asksaveasfilename(parent=self,title='Export Trace',initialdir='~/Documents',initialfile='colornamespace-trace.json',filetypes=[('Chrome Trace','*.json')],defaultextension='.json')
+        if not fpath:
+            return
+        try:
+            PROFILER.save_trace(fpath)
+        except OSError as err:
+            showerror('Export Error',f'Error! The trace could not be saved.\n{err}')
+
     def _show_plot(self):
+        if self._plotframe is None:
+            self._init_display()
         if self._plotframe.winfo_ismapped():
             self._plotframe.grid_forget()
             self._editmenu.entryconfig(2,label='Show Map')
@@ -521,130 +964,206 @@ class ColorNameMapper(tk.Tk):
             self._plotframe.columnconfigure(1,minsize=0)
     
     def _set_xmap(self,mapname):
-        xmapvals = array([list(range(self._axesmaps[mapname][1]))]*2)
-        self._xcolor.cla()
-        self._xcolor.set_xticks([])
-        self._xcolor.set_yticks([])
-        self._xcolor.pcolormesh(xmapvals,cmap = self._axesmaps[mapname][0](self._cross_section.get()))
-        self._xcolor.set_xbound(0,self._axesmaps[mapname][1])
-        self._axes.set_xbound(0,int(self._axesmaps[mapname][1]/2))
-        self._xcanvas.draw()
+        with PROFILER.span('set_xmap'):
+            self._set_bar('x',self._ximage,self._xcanvas,mapname)
     
     def _set_ymap(self,mapname):
-        ymapvals = array([[a,a] for a in range(self._axesmaps[mapname][1])])
-        self._ycolor.cla()
-        self._ycolor.set_xticks([])
-        self._ycolor.set_yticks([])
-        self._ycolor.pcolormesh(ymapvals,cmap = self._axesmaps[mapname][0](self._cross_section.get()))
-        self._ycolor.set_ybound(0,self._axesmaps[mapname][1])
-        self._axes.set_ybound(0,int(self._axesmaps[mapname][1]/2))
-        self._ycanvas.draw()
+        with PROFILER.span('set_ymap'):
+            self._set_bar('y',self._yimage,self._ycanvas,mapname)
+
+    def _set_bar(self,axis,image,canvas,mapname):
+        key = (mapname,self._cross_section.get())
+        if self._shown_bars.get(axis) == key:
+            return
+        colors = self._axesmaps[mapname][section_index(101,key[1])]
+        n = len(colors)
+        image.set_data(colors[None] if axis == 'x' else colors[:,None])
+        extent = (0,n,0,1) if axis == 'x' else (0,1,0,n)
+        image.set_extent(extent)
+        image.axes.set_xlim(extent[:2])
+        image.axes.set_ylim(extent[2:])
+        image.set_visible(True)
+        self._shown_bars[axis] = key
+        canvas.draw_idle()
 
     def _display_map(self,event=None):
-        self._clear_map()
-        
-        if self._datamap_is_old:
+        with PROFILER.span('display_map',view=self.plottype.get()):
+            self._show_map()
+
+    def _show_map(self):
+        if self._map_revision != self._revision:
             self._build_map()
         
-        if self.plottype.get() == 'Saturation-Hue':
-            self._set_xmap('h')
-            self._set_ymap('s')
-            self._cross_section_label.config(text='Value %:')
-            dispmap = self._datamap[:,:,int(float(self._cross_section.get())/100.0*(self._datamap.shape[2]-1))]
-            dispmap = dispmap.transpose()
-        elif self.plottype.get() == 'Value-Hue':
-            self._set_xmap('h')
-            self._set_ymap('v')
-            self._cross_section_label.config(text='Saturation %:')
-            dispmap = squeeze(self._datamap[:,int(float(self._cross_section.get())/100.0*(self._datamap.shape[1]-1)),:])
-            dispmap = dispmap.transpose()
-        elif self.plottype.get() == 'Green-Red':
-            self._set_xmap('r')
-            self._set_ymap('g')
-            self._cross_section_label.config(text='Blue %:')
-            dispmap = self._datamap[:,:,int(float(self._cross_section.get())/100.0*(self._datamap.shape[1]-1))]
-        elif self.plottype.get() == 'Blue-Red':
-            self._set_xmap('r2')
-            self._set_ymap('b')
-            self._cross_section_label.config(text='Green %:')
-            dispmap = squeeze(self._datamap[int(float(self._cross_section.get())/100.0*self._datamap.shape[0]),:,:])
-            dispmap = dispmap.transpose()
-        elif self.plottype.get() == 'Blue-Green':
-            self._set_xmap('g2')
-            self._set_ymap('b2')
-            self._cross_section_label.config(text='Red %:')
-            dispmap = squeeze(self._datamap[:,int(float(self._cross_section.get())/100.0*(self._datamap.shape[1]-1)),:])
-            dispmap = dispmap.transpose()
-
-        self._axes.pcolormesh(dispmap,cmap=self.colormap,vmin=0,vmax=len(self.color_names))
-        self._displaycanvas.draw()
+        xmap, ymap, label = self._plotaxes[self.plottype.get()]
+        self._set_xmap(xmap)
+        self._set_ymap(ymap)
+        self._cross_section_label.config(text=label)
+        if self._show_differences.get() and self._comparison is not None:
+            self._display_differences()
+            return
+        if self._show_consensus.get() and self._consensus is not None:
+            self._display_consensus()
+            return
+        dispmap = self._map.cached_section(self.plottype.get(),self._cross_section.get())
+        if dispmap is not None:
+            self._draw_section(dispmap)
+        elif self._patching:
+            # The patched volumes arrive shortly; building them again would only race them.
+            self._map_pending = True
+            self._map_status.config(text='Updating...')
+        else:
+            PROFILER.count('section_misses')
+            self._request_map()
+
+    def _toggle_consensus(self):
+        if self._show_consensus.get():
+            self._show_differences.set(False)
+        self._map_status.config(text='')
+        self._display_map()
+
+    def _display_consensus(self):
+        view = self.plottype.get()
+        self._map_pending = False
+        if VIEWS[view][0] != self._consensus.space:
+            self._map_status.config(text=f'The consensus map covers {self._consensus.space.upper()} views only.')
+            return
+        self._map_status.config(text=f'Consensus of {len(self._consensus)} sessions')
+        self._draw_section(self._consensus.section(view,self._cross_section.get()),self._consensus.step)
+
+    def _display_differences(self):
+        view = self.plottype.get()
+        comparison = self._comparison
+        self._map_pending = False
+        if VIEWS[view][0] != comparison.space:
+            self._map_status.config(text=f'The comparison covers {comparison.space.upper()} views only.')
+            return
+        i, j = self._pair
+        value = self._cross_section.get()
+        names = comparison.names
+        self._map_status.config(text=f'{names[i]}, with differences from {names[j]} in cyan')
+        self._draw_section(ma.masked_array(comparison.section(i,view,value),comparison.disagreement_section(i,j,view,value)),comparison.step)
+
+    def _draw_section(self,dispmap,step=None):
+        if self._map_requested is not None:
+            # Time from asking the worker for a section to showing it.
+            PROFILER.record('map_wait',self._map_requested)
+            self._map_requested = None
+        self._map_pending = False
+        self._shown_section = ma.getdata(dispmap)
+        # The grid of the drawn section, which the color peek reads its colors from.
+        self._shown_view = (self.plottype.get(),self._cross_section.get(),self._map.step if step is None else step)
+        self._peek_colors = None
+        h, w = dispmap.shape
+        self._mapimage.set_data(dispmap)
+        self._mapimage.set_extent((0,w,0,h))
+        self._axes.set_xlim(0,w)
+        self._axes.set_ylim(0,h)
+        self._mapimage.set_visible(True)
+        self._displaycanvas.draw_idle()
+
+    def _request_map(self):
+        self._map_cancel.set()
+        self._map_cancel = threading.Event()
+        self._map_pending = True
+        if self._map_requested is None:
+            self._map_requested = perf_counter_ns()
+        self._map_status.config(text='Building...')
+        polling = self._map_thread is not None and self._map_thread.is_alive()
+        self._map_thread = threading.Thread(target=self._map_worker,args=(self._map.copy(),self.plottype.get(),self._cross_section.get(),self._map_cancel),daemon=True)
+        self._map_thread.start()
+        if not polling:
+            self.after(20,self._poll_map)
+
+    def _map_worker(self,snapshot,view,value,cancel):
+        # Runs off the Tk thread, so results only go back through the queue.
+        try:
+            with PROFILER.span('section',view=view,value=value):
+                snapshot.section(view,value,cancel=cancel)
+            self._map_queue.put((snapshot,None))
+            with PROFILER.span('volume',space=VIEWS[view][0]):
+                if snapshot.adaptive:
+                    snapshot.octree(VIEWS[view][0],cancel=cancel)
+                else:
+                    snapshot.volume(VIEWS[view][0],cancel=cancel)
+            self._map_queue.put((snapshot,None))
+        except BuildCancelled:
+            pass
+        except Exception as err:
+            self._map_queue.put((snapshot,err))
+
+    def _poll_map(self):
+        alive = self._map_thread.is_alive()
+        error = None
+        while True:
+            try:
+                snapshot, err = self._map_queue.get_nowait()
+            except Empty:
+                break
+            if err is not None:
+                error = err
+            elif self._map.merge(snapshot):
+                self._share('publish')
+                if self._map_pending:
+                    dispmap = self._map.cached_section(self.plottype.get(),self._cross_section.get())
+                    if dispmap is not None:
+                        self._draw_section(dispmap)
+        if error is not None:
+            self._map_status.config(text=error.args[0] if len(error.args) > 0 else 'Unknown Error')
+        if alive:
+            self.after(20,self._poll_map)
+        elif error is None:
+            self._map_status.config(text='')
+
+    def _cancel_map(self):
+        self._map_cancel.set()
     
     def _build_map(self):
-        if self.plottype.get() in ('Saturation-Hue','Value-Hue'):
-            d = [rgb_to_hsv(*(float(int(c[a:a+2],base=16))/255.0 for a in (1,3,5))) + (i,) for c,i in self._data]
-            d = [(int(a[0]*359),int(a[1]*99),int(a[2]*99),a[3]) for a in d]
-            cv = [a for *a,_ in d]
-            for i in range(0,360,5):
-                if (i,0,99) not in cv:
-                    d.append((i,0,99,10))
-                for j in range(0,100,5):
-                    if (i,0,0) not in cv:
-                        d.append((i,j,0,9))
-            [X,Y,Z] = meshgrid([range(0,360,2)],[range(0,100,2)],[range(0,100,2)],indexing='ij')
-            interp = NearestNDInterpolator([a for *a,_ in d],[a for *_,a in d])
-        else:
-            d = [tuple(int(c[a:a+2],base=16) for a in (1,3,5)) + (i,) for c,i in self._data]
-            [X,Y,Z] = meshgrid([range(0,256,2)],[range(0,256,2)],[range(0,256,2)])
-            interp = NearestNDInterpolator([a for *a,_ in d],[a for *_,a in d])
-        self._datamap = interp(X,Y,Z)
-        self._datamap_is_old = False
+        with PROFILER.span('build_map',answers=len(self._data)):
+            self._map.set_data(self._data)
+        self._map_revision = self._revision
         
     def _switchplot(self,event):
-        self._datamap_is_old = True
         self._display_map()
     
     def _clear_map(self):
-        self._axes.cla()
-        self._axes.set_yticks([])
-        self._axes.set_xticks([])
-        self._xcolor.cla()
-        self._xcolor.set_yticks([])
-        self._xcolor.set_xticks([])
-        self._ycolor.cla()
-        self._ycolor.set_yticks([])
-        self._ycolor.set_xticks([])
+        for image in (self._mapimage,self._ximage,self._yimage):
+            image.set_visible(False)
+        self._shown_bars.clear()
+        self._shown_section = None
+        self._colorpeek_off()
+        self._displaycanvas.draw_idle()
+        self._xcanvas.draw_idle()
+        self._ycanvas.draw_idle()
     
     def _colorpeek(self,event=None):
-        if self.plottype.get() == 'Saturation-Hue':
-            h = event.xdata/self._axes.get_xbound()[1]
-            s = event.ydata/self._axes.get_ybound()[1]
-            v = self._cross_section.get()/100.0
-            r,g,b = hsv_to_rgb(h,s,v)
-        elif self.plottype.get() == 'Value-Hue':
-            h = event.xdata/self._axes.get_xbound()[1]
-            v = event.ydata/self._axes.get_ybound()[1]
-            s = self._cross_section.get()/100.0
-            r,g,b = hsv_to_rgb(h,s,v)
-        elif self.plottype.get() == 'Saturation-Hue':
-            h = event.xdata/self._axes.get_xbound()[1]
-            s = event.ydata/self._axes.get_ybound()[1]
-            v = self._cross_section.get()/100.0
-            r,g,b = hsv_to_rgb(h,s,v)
-        elif self.plottype.get() == 'Green-Red':
-            r = event.xdata/self._axes.get_xbound()[1]
-            g = event.ydata/self._axes.get_ybound()[1]
-            b = self._cross_section.get()/100.0
-        elif self.plottype.get() == 'Blue-Red':
-            r = event.xdata/self._axes.get_xbound()[1]
-            b = event.ydata/self._axes.get_ybound()[1]
-            g = self._cross_section.get()/100.0
-        elif self.plottype.get() == 'Blue-Green':
-            g = event.xdata/self._axes.get_xbound()[1]
-            b = event.ydata/self._axes.get_ybound()[1]
-            r = self._cross_section.get()/100.0
-        
-        r,g,b = tuple(int(c*255) for c in (r,g,b))
+        # Motion events only record the position; one update runs per idle.
+        self._peek_at = (event.xdata,event.ydata)
+        if self._peek_job is None:
+            self._peek_job = self.after_idle(self._update_colorpeek)
+
+    def _update_colorpeek(self):
+        self._peek_job = None
+        section = self._shown_section
+        x, y = self._peek_at
+        if section is None or x is None or y is None:
+            return
+        if self._peek_colors is None:
+            self._peek_colors = section_colors(*self._shown_view)
+        h, w = section.shape
+        row = min(max(int(y),0),h-1)
+        col = min(max(int(x),0),w-1)
+        shown = (tuple(self._peek_colors[row,col].tolist()),int(section[row,col]))
+        if shown == self._peek_shown:
+            return
+        self._peek_shown = shown
+        (r,g,b), label = shown
         self._colorpeek_viewer.config(bg=f'#{r:02X}{g:02X}{b:02X}')
+        self._colorpeek_name.config(text=self.color_names[label])
 
     def _colorpeek_off(self,event=None):
-        self._colorpeek_viewer.config(bg=BG)
\ No newline at end of file
+        if self._peek_job is not None:
+            self.after_cancel(self._peek_job)
+            self._peek_job = None
+        self._peek_shown = None
+        self._colorpeek_viewer.config(bg=BG)
+        self._colorpeek_name.config(text='')
@@ -0,0 +1,148 @@
+'''Perceptual color spaces used to measure the distance between colors.
+
+Nearest-sample maps built in raw RGB or scaled HSV coordinates give too much
+weight to some directions, and HSV distances ignore that hue wraps around.
+The spaces here convert 0-255 sRGB values into coordinates in which Euclidean
+distance follows perceived color difference.
+'''
+import numpy as np
+
+# Linear sRGB to XYZ under D65.
+_SRGB_TO_XYZ = np.array([
+    (0.4124564,0.3575761,0.1804375),
+    (0.2126729,0.7151522,0.0721750),
+    (0.0193339,0.1191920,0.9503041)
+])
+_D65 = np.array((0.95047,1.0,1.08883))
+_LAB_FROM_F = np.array([(0,116,0),(500,-500,0),(0,200,-200)],dtype=np.float64)
+
+# Linear sRGB to LMS and LMS' to OKLab, from Ottosson's reference implementation.
+_SRGB_TO_LMS = np.array([
+    (0.4122214708,0.5363325363,0.0514459929),
+    (0.2119034982,0.6806995451,0.1073969566),
+    (0.0883024619,0.2817188376,0.6299787005)
+])
+_OKLAB_FROM_LMS = np.array([
+    (0.2104542553,0.7936177850,-0.0040720468),
+    (1.9779984951,-2.4285922050,0.4505937099),
+    (0.0259040371,0.7827717662,-0.8086757660)
+])
+
+
+def srgb_to_linear(rgb):
+    '''Undo the sRGB transfer curve of 0-255 values, giving linear light in [0,1].'''
+    c = np.asarray(rgb,dtype=np.float64)/255.0
+    return np.where(c <= 0.04045,c/12.92,((c+0.055)/1.055)**2.4)
+
+def _linear_slope(rgb):
+    # Derivative of srgb_to_linear, which increases with the value.
+    c = np.asarray(rgb,dtype=np.float64)/255.0
+    return np.where(c <= 0.04045,1/12.92,2.4/1.055*((c+0.055)/1.055)**1.4)/255.0
+
+def _cbrt_slope(t):
+    with np.errstate(divide='ignore'):
+        return 1/(3*np.cbrt(t)**2)
+
+def _lab_f(t):
+    d = 6/29
+    return np.where(t > d**3,np.cbrt(t),t/(3*d*d) + 4/29)
+
+def _lab_f_slope(t):
+    d = 6/29
+    with np.errstate(divide='ignore'):
+        return np.where(t > d**3,1/(3*np.cbrt(t)**2),1/(3*d*d))
+
+
+class ColorSpace:
+    '''A map from sRGB to coordinates linear @ y + offset, with y = g(M @ srgb_to_linear(rgb)).
+
+    Every entry of M is positive and g is increasing with a decreasing slope,
+    so y is increasing in each of R, G and B and the range of its Jacobian
+    over an RGB box is known from the box's corners. bounds() uses both
+    facts to enclose the image of a box, which lets label_grid fill whole
+    blocks of an RGB grid at once.
+    '''
+    def __init__(self, name, matrix, compress, slope, linear, offset=(0,0,0)) -> None:
+        self.name = name
+        self.linear = np.asarray(linear,dtype=np.float64)
+        self.offset = np.asarray(offset,dtype=np.float64)
+        self._matrix = matrix
+        self._compress = compress
+        self._slope = slope
+        self._corners = np.array([(i,j,k) for i in (-1,1) for j in (-1,1) for k in (-1,1)]) @ self.linear.T
+        self._pos = np.maximum(self.linear,0)
+        self._neg = np.minimum(self.linear,0)
+
+    def __repr__(self) -> str:
+        return f'ColorSpace({self.name!r})'
+
+    def monotone(self, rgb):
+        '''Return the y coordinates of an (N,3) array of 0-255 RGB values.'''
+        return self._compress(srgb_to_linear(rgb) @ self._matrix.T)
+
+    def convert(self, rgb):
+        '''Convert an (N,3) array of 0-255 RGB values into (N,3) coordinates in this space.'''
+        return self.monotone(np.asarray(rgb).reshape(-1,3)) @ self.linear.T + self.offset
+
+    def bounds(self, lo, hi):
+        '''Enclose the images of the RGB boxes with corners `lo` and `hi`, both (N,3).
+
+        Returns the image of each box centre, a radius around it that covers
+        the box, and a function that maps (N,k,3) directions d to the largest
+        d . (x - centre) over each box.
+        '''
+        mid = (lo+hi)/2
+        h = (hi-lo)/2
+        centre = self.convert(mid)
+        # The y of the box lie in the box spanned by the y of its corners.
+        ylo = self.monotone(lo)
+        yhi = self.monotone(hi)
+        yc = (ylo+yhi)/2
+        yh = (yhi-ylo)/2
+        shift = yc @ self.linear.T + self.offset - centre
+        # By the mean value theorem, y - y(mid) = J (rgb - mid) with every
+        # entry of J between those of jlo and jhi, which are all positive.
+        ulo = srgb_to_linear(lo) @ self._matrix.T
+        uhi = srgb_to_linear(hi) @ self._matrix.T
+        jlo = self._slope(uhi)[:,:,None]*self._matrix*_linear_slope(lo)[:,None,:]
+        jhi = self._slope(ulo)[:,:,None]*self._matrix*_linear_slope(hi)[:,None,:]
+        # Bounds of linear @ J, entry by entry.
+        klo = np.einsum('ri,bij->brj',self._pos,jlo) + np.einsum('ri,bij->brj',self._neg,jhi)
+        khi = np.einsum('ri,bij->brj',self._pos,jhi) + np.einsum('ri,bij->brj',self._neg,jlo)
+        with np.errstate(invalid='ignore'):
+            rows = (np.maximum(np.abs(klo),np.abs(khi))*h[:,None,:]).sum(-1)
+            radius = np.fmin(np.sqrt((rows**2).sum(-1)),
+                np.sqrt(((yh[:,None,:]*self._corners)**2).sum(-1)).max(axis=1) + np.sqrt((shift**2).sum(-1)))
+
+        def spread(d):
+            # Over the y box: the largest d . (linear @ y + offset - centre).
+            w = d @ self.linear
+            boxed = (shift[:,None,:]*d).sum(-1) + (np.abs(w)*yh[:,None,:]).sum(-1)
+            # Through J: choose each entry and the sign of each RGB offset.
+            v = w.clip(min=0)
+            u = w.clip(max=0)
+            up = np.einsum('bki,bij->bkj',v,jhi) + np.einsum('bki,bij->bkj',u,jlo)
+            down = -(np.einsum('bki,bij->bkj',v,jlo) + np.einsum('bki,bij->bkj',u,jhi))
+            with np.errstate(invalid='ignore'):
+                return np.fmin(boxed,(np.maximum(up,down)*h[:,None,:]).sum(-1))
+
+        return centre, radius, spread
+
+
+OKLAB = ColorSpace('oklab',_SRGB_TO_LMS,np.cbrt,_cbrt_slope,_OKLAB_FROM_LMS)
+CIELAB = ColorSpace('cielab',_SRGB_TO_XYZ/_D65[:,None],_lab_f,_lab_f_slope,_LAB_FROM_F,offset=(-16,0,0))
+
+# metric name -> ColorSpace
+SPACES = {
+    'oklab':OKLAB,
+    'cielab':CIELAB
+}
+
+
+def rgb_to_oklab(rgb):
+    '''Convert an (N,3) array of 0-255 RGB values to OKLab.'''
+    return OKLAB.convert(rgb)
+
+def rgb_to_lab(rgb):
+    '''Convert an (N,3) array of 0-255 RGB values to CIELAB under D65.'''
+    return CIELAB.convert(rgb)
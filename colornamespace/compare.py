@@ -0,0 +1,141 @@
+'''Comparison of the color name maps of several sessions.'''
+from pathlib import Path
+import numpy as np
+from .engine import ColorSpaceMap, COLOR_NAMES, VIEWS, section_index
+from .session import load_session
+from .store import MapStore
+
+N_LABELS = len(COLOR_NAMES)
+
+# Cells compared at once when a session is checked against the rest.
+_CELLS = 1 << 24
+
+
+def build_volume(session, space='hsv', step=2):
+    '''Return the label volume of a session, loading it first if given a file path.
+
+    A MapStore is attached read-only, so a volume it already holds is not rebuilt.
+    '''
+    if isinstance(session,MapStore):
+        return session.attach(step=step).volume(space)
+    if isinstance(session,(str,Path)):
+        session = load_session(session,mmap_mode='r')
+    return ColorSpaceMap(session,step=step).volume(space)
+
+
+class SessionComparison:
+    '''Label volumes of several sessions on one grid and the agreement between them.
+
+    `sessions` holds Session objects, ('#RRGGBB', label index) sequences or
+    session file paths. Every volume is built on the grid of `space` with one
+    cell every `step` units, in `workers` processes if more than one. Pairwise
+    results are computed on first use and cached. `progress`, if given, is
+    called with (done, total) as each volume is built.
+    '''
+    def __init__(self, sessions, names=None, space='hsv', step=2, workers=1, progress=None) -> None:
+        sessions = list(sessions)
+        if len(sessions) == 0:
+            raise ValueError('At least one session is needed for a comparison.')
+        if names is None:
+            names = [Path(s).stem if isinstance(s,(str,Path)) else f'Session {i+1}' for i,s in enumerate(sessions)]
+        self.names = list(names)
+        self.space = space
+        self.step = step
+        n = len(sessions)
+        volumes = []
+        if workers == 1 or n == 1:
+            for s in sessions:
+                volumes.append(build_volume(s,space,step))
+                if progress is not None:
+                    progress(len(volumes),n)
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for volume in pool.map(build_volume,sessions,[space]*n,[step]*n):
+                    volumes.append(volume)
+                    if progress is not None:
+                        progress(len(volumes),n)
+        self.volumes = np.stack(volumes)
+        self._confusion = {}
+        self._slices = {}
+        self._agreement = None
+
+    def __len__(self) -> int:
+        return len(self.volumes)
+
+    def disagreement(self, i, j):
+        '''Return a boolean volume that is True where sessions i and j name a cell differently.'''
+        return self.volumes[i] != self.volumes[j]
+
+    def section(self, i, view, value):
+        '''Return the labels session i gives in the 2-D section shown by `view` at `value` percent.'''
+        axis = self._axis(view)
+        return self.volumes[i].take(section_index(self.volumes.shape[axis+1],value),axis=axis).transpose()
+
+    def disagreement_section(self, i, j, view, value):
+        '''Return the 2-D section of disagreement(i, j) shown by `view` at `value` percent.'''
+        axis = self._axis(view)
+        index = section_index(self.volumes.shape[axis+1],value)
+        return (self.volumes[i].take(index,axis=axis) != self.volumes[j].take(index,axis=axis)).transpose()
+
+    def disagreement_fraction(self):
+        '''Return the fraction of session pairs that disagree at each cell as a float volume.'''
+        n = len(self)
+        if n < 2:
+            return np.zeros(self.volumes.shape[1:])
+        agree = np.zeros(self.volumes.shape[1:],dtype=np.int64)
+        count = np.empty(self.volumes.shape[1:],dtype=np.int64)
+        for label in range(N_LABELS):
+            count[...] = 0
+            for vol in self.volumes:
+                count += vol == label
+            agree += count*(count-1)//2
+        return 1.0 - agree/(n*(n-1)//2)
+
+    def confusion(self, i, j):
+        '''Return the (12,12) count of cells named row label by session i and column label by session j.'''
+        key = (min(i,j),max(i,j))
+        if key not in self._confusion:
+            # 12*11+11 fits in a byte, so the pair codes need no wider type.
+            codes = self.volumes[key[0]].ravel()*np.uint8(N_LABELS) + self.volumes[key[1]].ravel()
+            self._confusion[key] = np.bincount(codes,minlength=N_LABELS*N_LABELS).reshape(N_LABELS,N_LABELS)
+        return self._confusion[key] if i <= j else self._confusion[key].T
+
+    def agreement(self, i, j) -> float:
+        '''Return the fraction of cells that sessions i and j name the same.'''
+        return float(self.agreement_matrix()[i,j])
+
+    def agreement_matrix(self):
+        '''Return the (N,N) matrix of pairwise agreement fractions.
+
+        Each session is compared against all later ones at once, a block of
+        volumes at a time so that memory stays bounded.
+        '''
+        if self._agreement is None:
+            n = len(self)
+            cells = self.volumes[0].size
+            block = max(1,_CELLS // cells)
+            agreement = np.eye(n)
+            flat = self.volumes.reshape(n,-1)
+            for i in range(n):
+                for start in range(i+1,n,block):
+                    same = np.count_nonzero(flat[start:start+block] == flat[i],axis=1)/cells
+                    agreement[i,start:start+block] = same
+                    agreement[start:start+block,i] = same
+            self._agreement = agreement
+        return self._agreement
+
+    def slice_agreement(self, i, j, view):
+        '''Return the fraction of cells sessions i and j name the same in every section of `view`.'''
+        axis = self._axis(view)
+        key = (min(i,j),max(i,j),axis)
+        if key not in self._slices:
+            other = tuple(a for a in range(3) if a != axis)
+            self._slices[key] = (self.volumes[i] == self.volumes[j]).mean(axis=other)
+        return self._slices[key]
+
+    def _axis(self, view):
+        space, axis = VIEWS[view]
+        if space != self.space:
+            raise ValueError(f'View {view!r} is not in the {self.space!r} space of this comparison.')
+        return axis
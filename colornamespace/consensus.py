@@ -0,0 +1,141 @@
+'''Population consensus maps built from the label volumes of many sessions.'''
+from math import ceil
+import os
+import numpy as np
+from .engine import ColorSpaceMap, EXTENTS, VIEWS, section_index
+from .compare import N_LABELS, build_volume
+
+
+class ConsensusMap:
+    '''Per-cell counts of the labels given by many sessions on one grid.
+
+    Sessions are added one at a time, so memory does not grow with their
+    number: `counts` holds one count per cell and label. Maps over the same
+    grid can be merged, which lets parts of a population be counted in
+    separate processes.
+    '''
+    def __init__(self, space='hsv', step=2, dtype=np.uint32) -> None:
+        if space not in EXTENTS:
+            raise ValueError(f'Unknown color space: {space!r}')
+        self.space = space
+        self.step = int(step)
+        self.shape = tuple(len(a) for a in ColorSpaceMap(step=step).grid(space))
+        self.counts = np.zeros(self.shape+(N_LABELS,),dtype=dtype)
+        self.sessions = 0
+        self._offsets = None
+        self._modal = None
+
+    def __len__(self) -> int:
+        '''Number of sessions counted.'''
+        return self.sessions
+
+    def add(self, session) -> None:
+        '''Count the map of a Session, ('#RRGGBB', label index) sequence or session file.'''
+        self.add_volume(build_volume(session,self.space,self.step))
+
+    def add_volume(self, volume) -> None:
+        '''Count a label volume built on this map's grid.'''
+        volume = np.asarray(volume)
+        if volume.shape != self.shape:
+            raise ValueError(f'Expected a volume of shape {self.shape}, not {volume.shape}.')
+        if self._offsets is None:
+            self._offsets = np.arange(0,self.counts.size,N_LABELS)
+        self.counts.reshape(-1)[self._offsets + volume.ravel()] += 1
+        self.sessions += 1
+        self._modal = None
+
+    def merge(self, other):
+        '''Add the counts of another ConsensusMap over the same grid and return self.'''
+        if (other.space,other.step) != (self.space,self.step):
+            raise ValueError('Only consensus maps of the same space and step can be merged.')
+        self.counts += other.counts
+        self.sessions += other.sessions
+        self._modal = None
+        return self
+
+    def probabilities(self):
+        '''Return the fraction of sessions giving each label at each cell, shaped (*grid, 12).'''
+        return self.counts/np.float32(max(self.sessions,1))
+
+    def modal(self):
+        '''Return the volume of the most common label at each cell, the lowest label on ties.'''
+        if self._modal is None:
+            self._modal = self.counts.argmax(axis=-1).astype(np.uint8)
+        return self._modal
+
+    def entropy(self):
+        '''Return the entropy of the label distribution at each cell in bits.
+
+        It is 0 where every session agrees and log2(12) where the labels are
+        spread evenly.
+        '''
+        result = np.zeros(self.shape,dtype=np.float32)
+        if self.sessions == 0:
+            return result
+        # One plane at a time keeps the float temporaries small.
+        for i in range(self.shape[0]):
+            result[i] = _entropy(self.counts[i],self.sessions)
+        return result
+
+    def section(self, view, value):
+        '''Return the modal labels in the section shown by `view` at `value` percent.'''
+        return self._section(self.modal(),view,value)
+
+    def entropy_section(self, view, value):
+        '''Return the entropy in the section shown by `view` at `value` percent.'''
+        axis = self._view(view)
+        index = section_index(self.shape[axis],value)
+        planes = [slice(None)]*3
+        planes[axis] = slice(index,index+1)
+        entropy = _entropy(self.counts[tuple(planes)],max(self.sessions,1))
+        return np.squeeze(entropy,axis=axis).transpose()
+
+    def _section(self, volume, view, value):
+        axis = self._view(view)
+        return volume.take(section_index(self.shape[axis],value),axis=axis).transpose()
+
+    def _view(self, view):
+        space, axis = VIEWS[view]
+        if space != self.space:
+            raise ValueError(f'View {view!r} is not in the {self.space!r} space of this consensus map.')
+        return axis
+
+
+def _entropy(counts, sessions):
+    p = counts/np.float32(sessions)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        return -np.where(p > 0,p*np.log2(p),0).sum(axis=-1)
+
+
+def _count_sessions(sessions, space, step, progress=None):
+    consensus = ConsensusMap(space,step)
+    for session in sessions:
+        consensus.add(session)
+        if progress is not None:
+            progress(len(consensus),len(sessions))
+    # The offsets are rebuilt on demand and need not be sent back to the parent.
+    consensus._offsets = None
+    return consensus
+
+def build_consensus(sessions, space='hsv', step=2, workers=None, chunk=None, progress=None) -> ConsensusMap:
+    '''Count the maps of many sessions into one ConsensusMap.
+
+    With `workers` other than 1 the sessions are split into chunks of `chunk`
+    (by default about four per worker), counted in a process pool and merged
+    as each chunk finishes. `progress`, if given, is called with (done,
+    total) as sessions are counted.
+    '''
+    sessions = list(sessions)
+    if workers == 1 or len(sessions) < 2:
+        return _count_sessions(sessions,space,step,progress)
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    workers = workers or os.cpu_count() or 1
+    chunk = chunk or max(1,ceil(len(sessions)/(4*workers)))
+    consensus = ConsensusMap(space,step)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_count_sessions,sessions[i:i+chunk],space,step) for i in range(0,len(sessions),chunk)]
+        for future in as_completed(futures):
+            consensus.merge(future.result())
+            if progress is not None:
+                progress(len(consensus),len(sessions))
+    return consensus
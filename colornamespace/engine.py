@@ -0,0 +1,657 @@
+'''Headless construction of color name maps.
+
+The classes in this module do not depend on tkinter or matplotlib, so label
+volumes can be computed on machines without a display.
+'''
+from collections import OrderedDict
+import numpy as np
+from .colorspaces import SPACES
+from .profiling import PROFILER
+from .octree import LabelOctree
+
+COLOR_NAMES = ('Red','Pink','Orange','Yellow','Green','Blue','Purple','Brown','Gray','Black','White','None')
+LABEL_COLORS = ((1,0,0,1),(1,0,0.5,1),(1,0.25,0,1),(1,1,0,1),(0,1,0,1),(0,0,1,1),(0.6,0,0.6,1),(0.5,0.25,0,1),(0.5,0.5,0.5,1),(0,0,0,1),(1,1,1,1),(0.25,0.25,0.25,1))
+LABEL_RGB = np.round(np.array(LABEL_COLORS)[:,:3]*255).astype(np.uint8)
+
+# view name -> (color space, axis held fixed by the cross-section)
+# Sections are returned transposed so rows run along the view's y axis.
+VIEWS = {
+    'Saturation-Hue':('hsv',2),
+    'Value-Hue':('hsv',1),
+    'Green-Red':('rgb',2),
+    'Blue-Red':('rgb',1),
+    'Blue-Green':('rgb',0)
+}
+
+# Upper bounds of each axis of the sample coordinates in a color space.
+EXTENTS = {
+    'rgb':(256,256,256),
+    'hsv':(360,100,100)
+}
+
+# Value of each ASCII hex digit, 255 for anything else.
+_HEXDIGITS = np.full(256,255,dtype=np.uint8)
+for _i, _c in enumerate('0123456789abcdef'):
+    _HEXDIGITS[ord(_c)] = _HEXDIGITS[ord(_c.upper())] = _i
+
+# Axis bar gradients: name -> (color space, channel along the bar,
+# channel set by the cross-section percentage, number of colors)
+GRADIENTS = {
+    'h':('hsv',0,2,360),
+    's':('hsv',1,2,100),
+    'v':('hsv',2,1,100),
+    'r':('rgb',0,2,256),
+    'g':('rgb',1,2,256),
+    'b':('rgb',2,1,256),
+    'r2':('rgb',0,1,256),
+    'g2':('rgb',1,0,256),
+    'b2':('rgb',2,0,256)
+}
+
+# Black and white anchors (h, s, v, label) added along the edges of HSV space.
+_HSV_ANCHORS = np.array(
+    [(i,0,99,10) for i in range(0,360,5)] + [(i,j,0,9) for i in range(0,360,5) for j in range(0,100,5)]
+)
+
+
+# Cells queried per call once blocks can no longer be filled whole.
+_CHUNK = 1 << 16
+
+# Blocks tested at once, which bounds the memory of their k candidates.
+_BLOCKS = 1 << 14
+
+# Axes of the lookup table holding the label of every RGB color.
+_LUT_AXES = (range(256),)*3
+
+# Offsets of the eight children of an octree block.
+_CHILDREN = np.array([(i,j,k) for i in (0,1) for j in (0,1) for k in (0,1)])
+
+# Order of (v, p, q, t) in each sector of colorsys.hsv_to_rgb.
+_HSV_SECTORS = np.array([(0,3,1),(2,0,1),(1,0,3),(1,2,0),(3,1,0),(0,1,2)])
+
+
+def hex_to_rgb(colors):
+    '''Decode a sequence of '#RRGGBB' strings into an (N,3) uint8 array.'''
+    colors = list(colors)
+    if len(colors) == 0:
+        return np.zeros((0,3),dtype=np.uint8)
+    try:
+        buf = np.frombuffer(''.join(colors).encode('ascii'),dtype=np.uint8)
+    except UnicodeEncodeError:
+        raise ValueError('Color codes must be ASCII hex strings.') from None
+    if set(map(len,colors)) != {7}:
+        raise ValueError('Color codes must have the form #RRGGBB.')
+    buf = buf.reshape(-1,7)
+    digits = _HEXDIGITS[buf[:,1:]]
+    if (buf[:,0] != ord('#')).any() or (digits == 255).any():
+        raise ValueError('Color codes must have the form #RRGGBB.')
+    return (digits[:,0::2] << 4) | digits[:,1::2]
+
+def rgb_to_hex(rgb) -> list:
+    '''Encode an (N,3) array of 0-255 values as '#RRGGBB' strings.'''
+    return [f'#{r:02X}{g:02X}{b:02X}' for r,g,b in np.asarray(rgb).tolist()]
+
+def rgb_to_hsv(rgb):
+    '''Vectorized colorsys.rgb_to_hsv for an (N,3) array of 0-255 values.
+
+    Returns an (N,3) float array of hue, saturation and value in [0,1].
+    '''
+    rgb = np.asarray(rgb,dtype=np.float64)/255.0
+    r, g, b = rgb[:,0], rgb[:,1], rgb[:,2]
+    maxc = rgb.max(axis=1)
+    minc = rgb.min(axis=1)
+    rangec = maxc - minc
+    grey = rangec == 0
+    with np.errstate(divide='ignore',invalid='ignore'):
+        s = np.where(grey,0.0,rangec/maxc)
+        rc = (maxc-r)/rangec
+        gc = (maxc-g)/rangec
+        bc = (maxc-b)/rangec
+    h = np.where(r == maxc,bc-gc,np.where(g == maxc,2.0+rc-bc,4.0+gc-rc))
+    h = np.where(grey,0.0,(h/6.0) % 1.0)
+    return np.stack((h,s,maxc),axis=1)
+
+def hsv_to_rgb(hsv):
+    '''Vectorized colorsys.hsv_to_rgb for an (N,3) array of hue, saturation and value in [0,1].
+
+    Returns an (N,3) float array of red, green and blue in [0,1].
+    '''
+    hsv = np.asarray(hsv,dtype=np.float64)
+    h, s, v = hsv[:,0], hsv[:,1], hsv[:,2]
+    i = np.floor(h*6.0)
+    f = h*6.0 - i
+    pqt = np.stack((v,v*(1.0-s),v*(1.0-s*f),v*(1.0-s*(1.0-f))),axis=1)
+    return np.take_along_axis(pqt,_HSV_SECTORS[i.astype(int) % 6],axis=1)
+
+def gradient_table(name):
+    '''RGBA colors of the axis bar `name` for every cross-section percentage.
+
+    Returns a (101,n,4) uint8 array whose row p holds the n colors along the
+    axis with the cross-section at p percent.
+    '''
+    space, along, fixed, n = GRADIENTS[name]
+    table = np.zeros((101,n,3))
+    if space == 'hsv':
+        table[...,1] = 1.0
+        table[:,:,along] = np.arange(n)/n
+    else:
+        table[:,:,along] = np.arange(n)/(n-1)
+    table[:,:,fixed] = np.arange(101)[:,None]/100.0
+    if space == 'hsv':
+        table = hsv_to_rgb(table.reshape(-1,3)).reshape(table.shape)
+    rgba = np.full((101,n,4),255,dtype=np.uint8)
+    rgba[...,:3] = np.round(table*255)
+    return rgba
+
+
+class BuildCancelled(Exception):
+    '''Raised inside a map build when its cancel event has been set.'''
+
+
+class ColorSpaceMap:
+    '''Nearest-sample color name map built from (hex, label index) samples.
+
+    Volumes are indexed (R,G,B) in the 'rgb' space and (H,S,V) in the 'hsv'
+    space, with one cell every `step` units along each axis. With `lazy` set,
+    sections are computed plane by plane unless the whole volume has already
+    been built, and the most recent `cache_size` sections are kept.
+
+    By default the nearest sample is found in each volume's own coordinates.
+    Setting `metric` to a name in colorspaces.SPACES ('oklab' or 'cielab')
+    measures every distance in that perceptual space instead.
+
+    With `adaptive` set, whole maps are built as LabelOctree runs instead of
+    dense volumes, which keeps step 1 maps, with a cell for every RGB color
+    and every HSV coordinate, small.
+    '''
+    def __init__(self, data=(), step=2, lazy=False, cache_size=32, metric=None, adaptive=False) -> None:
+        self.step = int(step)
+        self.lazy = lazy
+        self.cache_size = cache_size
+        self.adaptive = adaptive
+        self.revision = 0
+        self._sections = OrderedDict()
+        self._octrees = {}
+        self.metric = None
+        self.set_metric(metric)
+        self.set_data(data)
+
+    def set_data(self, data) -> None:
+        '''Replace the samples and discard any computed volumes.
+
+        `data` is a Session, whose arrays are used without copying, or an
+        iterable of ('#RRGGBB', label index) pairs.
+        '''
+        if hasattr(data,'rgb') and hasattr(data,'labels'):
+            self._rgb = data.rgb
+            self._labels = data.labels
+        else:
+            data = list(data)
+            self._rgb = hex_to_rgb([c for c,_ in data])
+            self._labels = np.array([i for _,i in data],dtype=np.uint8)
+        self._volumes = {}
+        self._octrees = {}
+        self._trees = {}
+        self.revision += 1
+
+    def set_metric(self, metric) -> None:
+        '''Measure distances in the color space named `metric`, or in each volume's own coordinates if None.'''
+        if metric is not None and metric not in SPACES:
+            raise ValueError(f'Unknown color metric: {metric!r}')
+        self.metric = metric
+        self._volumes = {}
+        self._octrees = {}
+        self.revision += 1
+
+    def set_step(self, step, adaptive=None) -> None:
+        '''Change the grid spacing, and whether whole maps are built adaptively, discarding the maps built so far.'''
+        self.step = int(step)
+        if adaptive is not None:
+            self.adaptive = adaptive
+        self._volumes = {}
+        self._octrees = {}
+        self.revision += 1
+
+    def __len__(self) -> int:
+        return len(self._labels)
+
+    def append(self, color, label, patch=True) -> None:
+        '''Add one sample, patching any built volumes instead of rebuilding them.
+
+        Without `patch` the volumes are dropped instead, so that a copy made
+        beforehand can make the same change and patch them on another
+        thread; the patched copy then has this map's revision and can be
+        merged back.
+        '''
+        self._rgb = np.concatenate((self._rgb,hex_to_rgb([color]) if isinstance(color,str) else np.reshape(color,(1,3)).astype(np.uint8)))
+        self._labels = np.append(self._labels,np.uint8(label))
+        self._update(len(self._labels)-1,patch)
+
+    def relabel(self, index, label, patch=True) -> None:
+        '''Change the label of one sample, patching any built volumes as append() does.'''
+        self._labels = self._labels.copy()
+        self._labels[index] = label
+        self._update(index % len(self._labels),patch)
+
+    def _update(self, index, patch=True):
+        # Only cells inside the sample's Voronoi cell can change, so relabel
+        # the grid box around it with the new tree and keep the rest.
+        # A perceptual metric has no such box in grid coordinates, so its
+        # volumes are dropped and rebuilt when next asked for.
+        # Octrees get the same box as dense cells spliced into their runs.
+        volumes = self._volumes
+        octrees = self._octrees
+        self._volumes = {}
+        self._octrees = {}
+        self._trees = {}
+        self.revision += 1
+        if self.metric is not None or not patch:
+            return
+        for space, octree in octrees.items():
+            with PROFILER.span('patch',volume=space,octree=True):
+                tree, labels = self.tree(space)
+                axes = self.grid(space)
+                box = voronoi_box(tree,index,axes)
+                cells = np.stack(np.meshgrid(*(np.arange(len(a))[b] for a,b in zip(axes,box)),indexing='ij'),-1)
+                self._octrees[space] = octree.patched(cells,label_grid(tree,labels,[a[b] for a,b in zip(axes,box)]))
+        for key, vol in volumes.items():
+            with PROFILER.span('patch',volume=key):
+                space = 'rgb' if key == 'lut' else key
+                tree, labels = self.tree(space)
+                axes = _LUT_AXES if key == 'lut' else self.grid(space)
+                box = voronoi_box(tree,index,axes)
+                if not vol.flags.writeable:
+                    # Shared volumes are read-only; patch a private copy.
+                    vol = np.array(vol)
+                vol[box] = label_grid(tree,labels,[a[b] for a,b in zip(axes,box)])
+                self._volumes[key] = vol
+
+    def samples(self, space):
+        '''Return the sample coordinates and labels used to build a volume in `space`.'''
+        if space == 'hsv':
+            points = (rgb_to_hsv(self._rgb)*(359,99,99)).astype(np.int64)
+            # Anchor black and white along the edges, except where a sample already sits.
+            keys = points @ (10000,100,1)
+            anchors = _HSV_ANCHORS[~np.isin(_HSV_ANCHORS[:,:3] @ (10000,100,1),keys)]
+            return np.concatenate((points,anchors[:,:3])), np.concatenate((self._labels,anchors[:,3].astype(np.uint8)))
+        elif space == 'rgb':
+            return self._rgb.astype(np.int64), self._labels
+        elif space in SPACES:
+            return SPACES[space].convert(self._rgb), self._labels
+        else:
+            raise ValueError(f'Unknown color space: {space!r}')
+
+    def tree(self, space):
+        '''Return a KD-tree over the samples in `space` and the matching labels.'''
+        if space not in self._trees:
+            from scipy.spatial import cKDTree
+            points, labels = self.samples(space)
+            if len(points) == 0:
+                raise ValueError('Cannot build a color map without samples.')
+            with PROFILER.span('tree',space=space,samples=len(points)):
+                self._trees[space] = (cKDTree(points),labels)
+        return self._trees[space]
+
+    def label(self, space, axes, cancel=None):
+        '''Label each cell of the grid spanned by `axes`, in `space` coordinates, with its nearest sample.'''
+        with PROFILER.span('label',space=space,metric=self.metric,shape=[len(a) for a in axes]):
+            return self._label(space,axes,cancel)
+
+    def _label(self, space, axes, cancel=None):
+        if self.metric is None:
+            return label_grid(*self.tree(space),axes,cancel=cancel)
+        tree, labels = self.tree(self.metric)
+        if space == 'rgb':
+            return label_grid(tree,labels,axes,cancel=cancel,transform=SPACES[self.metric])
+        # HSV blocks have no simple bounds in a perceptual space, so every cell is queried.
+        points = np.stack(np.meshgrid(*[np.asarray(a,dtype=np.float64) for a in axes],indexing='ij'),-1)
+        coords = SPACES[self.metric].convert(_hsv_cells(points.reshape(-1,3)))
+        return label_points(tree,labels,coords,cancel).reshape(points.shape[:3])
+
+    def set_volume(self, space, volume) -> None:
+        '''Use a label volume built elsewhere for `space`, or for the 'lut' table.
+
+        The volume must come from the current samples, step and metric. It
+        is used without copying, so it may be a read-only memory map; a
+        later append or relabel patches a copy instead.
+        '''
+        shape = (256,)*3 if space == 'lut' else tuple(len(a) for a in self.grid(space))
+        if volume.shape != shape:
+            raise ValueError(f'Expected a volume of shape {shape}, not {volume.shape}.')
+        self._volumes[space] = volume
+
+    def octree(self, space, cancel=None) -> LabelOctree:
+        '''Return the labels of the whole grid of `space` as a LabelOctree, building it if necessary.'''
+        if space not in self._octrees:
+            with PROFILER.span('octree',space=space,step=self.step):
+                if space in self._volumes:
+                    octree = LabelOctree.from_volume(self._volumes[space])
+                elif self.metric is None:
+                    octree = label_octree(*self.tree(space),self.grid(space),cancel=cancel)
+                elif space == 'rgb':
+                    octree = label_octree(*self.tree(self.metric),self.grid(space),cancel=cancel,transform=SPACES[self.metric])
+                else:
+                    # As in label(), HSV cells have no block bounds in a perceptual space.
+                    octree = LabelOctree.from_volume(self.label(space,self.grid(space),cancel))
+            self._octrees[space] = octree
+        return self._octrees[space]
+
+    def built(self, space) -> bool:
+        '''Return whether the volume of `space`, or the 'lut' table, has already been built.'''
+        return space in self._volumes
+
+    def lut(self, cancel=None):
+        '''Return the (256,256,256) uint8 volume holding the label of every RGB color, building it if necessary.'''
+        if 'lut' not in self._volumes:
+            self._volumes['lut'] = self.label('rgb',_LUT_AXES,cancel)
+        return self._volumes['lut']
+
+    def classify(self, colors):
+        '''Return the labels of an (N,3) array of 0-255 RGB values or a sequence of '#RRGGBB' strings.
+
+        Colors are looked up in the table built by lut(), or in the RGB
+        octree of a step 1 map, if there is one; otherwise their nearest
+        samples are queried directly. Raises ValueError for values outside
+        0-255.
+        '''
+        colors = np.asarray(colors)
+        if colors.dtype.kind in 'UO':
+            colors = hex_to_rgb(colors.ravel().tolist())
+        if colors.shape[-1:] != (3,):
+            raise ValueError(f'Expected RGB colors in the last axis, not an array of shape {colors.shape}.')
+        rgb = colors.reshape(-1,3)
+        if rgb.dtype != np.uint8:
+            if rgb.size and (rgb.min() < 0 or rgb.max() > 255):
+                raise ValueError('RGB values must be between 0 and 255.')
+            rgb = rgb.astype(np.uint8)
+        if self.built('lut'):
+            return self._volumes['lut'][rgb[:,0],rgb[:,1],rgb[:,2]]
+        if self.step == 1 and 'rgb' in self._octrees:
+            return self._octrees['rgb'].lookup(rgb)
+        if self.metric is None:
+            tree, labels = self.tree('rgb')
+            return label_points(tree,labels,rgb)
+        tree, labels = self.tree(self.metric)
+        return label_points(tree,labels,SPACES[self.metric].convert(rgb))
+
+    def grid(self, space):
+        '''Return the cell coordinates along each axis of a volume in `space`.'''
+        return tuple(range(0,n,self.step) for n in EXTENTS[space])
+
+    def volume(self, space, cancel=None):
+        '''Return the label volume for `space`, building it if necessary.'''
+        if space not in self._volumes:
+            self._volumes[space] = self._build(space,cancel)
+        return self._volumes[space]
+
+    def _build(self, space, cancel=None):
+        return self.label(space,self.grid(space),cancel)
+
+    def section(self, view, value, cancel=None):
+        '''Return the 2-D cross-section shown by `view` at `value` percent along its fixed axis.
+
+        Rows of the result run along the view's y axis and columns along its x axis.
+        '''
+        sec = self.cached_section(view,value)
+        if sec is not None:
+            return sec
+        space, axis = VIEWS[view]
+        if not self.lazy:
+            if self.adaptive:
+                self.octree(space,cancel)
+            else:
+                self.volume(space,cancel)
+            return self.cached_section(view,value)
+        axes = self.grid(space)
+        index = section_index(len(axes[axis]),value)
+        axes = axes[:axis] + (axes[axis][index:index+1],) + axes[axis+1:]
+        sec = np.squeeze(self.label(space,axes,cancel),axis=axis).transpose()
+        self._sections[(view,index,self.revision)] = sec
+        while len(self._sections) > self.cache_size:
+            self._sections.popitem(last=False)
+        return sec
+
+    def section_colors(self, view, value):
+        '''Return the colors of the cells of section(view, value) as an (H,W,3) uint8 array.'''
+        return section_colors(view,value,self.step)
+
+    def cached_section(self, view, value):
+        '''Return a section if it can be had without labelling any cells, otherwise None.'''
+        space, axis = VIEWS[view]
+        if space in self._volumes:
+            vol = self._volumes[space]
+            return np.squeeze(vol.take(section_index(vol.shape[axis],value),axis=axis)).transpose()
+        if space in self._octrees:
+            octree = self._octrees[space]
+            return octree.section(axis,section_index(octree.shape[axis],value)).transpose()
+        key = (view,section_index(len(self.grid(space)[axis]),value),self.revision)
+        if key in self._sections:
+            self._sections.move_to_end(key)
+            return self._sections[key]
+        return None
+
+    def copy(self):
+        '''Return a copy that can be built on another thread while this map keeps changing.'''
+        other = ColorSpaceMap.__new__(ColorSpaceMap)
+        other.__dict__.update(self.__dict__)
+        other._rgb = self._rgb.copy()
+        other._labels = self._labels.copy()
+        other._volumes = dict(self._volumes)
+        other._octrees = dict(self._octrees)
+        other._trees = dict(self._trees)
+        other._sections = OrderedDict(self._sections)
+        return other
+
+    def merge(self, other) -> bool:
+        '''Adopt the trees, volumes and sections built by a copy made at the current revision.'''
+        if other.revision != self.revision or other.step != self.step:
+            return False
+        for space in other._trees.keys() - self._trees.keys():
+            self._trees[space] = other._trees[space]
+        for space in other._volumes.keys() - self._volumes.keys():
+            self._volumes[space] = other._volumes[space]
+        for space in other._octrees.keys() - self._octrees.keys():
+            self._octrees[space] = other._octrees[space]
+        for key in other._sections.keys() - self._sections.keys():
+            self._sections[key] = other._sections[key]
+        while len(self._sections) > self.cache_size:
+            self._sections.popitem(last=False)
+        return True
+
+
+def label_grid(tree, labels, axes, block=16, k=16, cancel=None, transform=None):
+    '''Label each cell of the grid spanned by `axes` with the label of its nearest point in `tree`.
+
+    Blocks of cells that provably share one nearest label are filled without
+    querying their cells; the remaining blocks are split in eight until they
+    are small enough to query cell by cell. The result is identical to
+    querying every cell. Returns a uint8 volume of shape (len(a) for a in axes).
+    If `cancel` is an event that gets set, BuildCancelled is raised.
+
+    A block is only filled if every corner is strictly nearer one label, so
+    a cell exactly as near to points of two labels is always queried, and
+    gets the label of the point `tree.query` returns for it. Which of the
+    tied points that is depends on how the tree was built, so tied cells
+    can differ from other nearest-neighbour searches over the same points,
+    such as scipy's NearestNDInterpolator.
+
+    With a `transform` such as a colorspaces.ColorSpace, the grid is in RGB
+    and `tree` holds points in the transformed space, and the transform's
+    bounds() stand in for the blocks' own extent.
+    '''
+    points = tree.data
+    labels = np.asarray(labels,dtype=np.uint8)
+    axes = [np.asarray(a,dtype=np.float64) for a in axes]
+    shape = np.array([len(a) for a in axes])
+    out = np.empty(tuple(shape),dtype=np.uint8)
+    k = min(k,len(points))
+    origins = np.stack(np.meshgrid(*(np.arange(0,n,block) for n in shape),indexing='ij'),-1).reshape(-1,3)
+    size = block
+    while len(origins) and size > 2:
+        if cancel is not None and cancel.is_set():
+            raise BuildCancelled()
+        hi = np.minimum(origins+size,shape)
+        uniform, lab = _uniform_blocks(tree,labels,axes,origins,hi-1,k,transform)
+        for (a,b,c),(x,y,z),l in zip(origins[uniform],hi[uniform],lab[uniform]):
+            out[a:x,b:y,c:z] = l
+        size //= 2
+        origins = (origins[~uniform][:,None,:] + _CHILDREN*size).reshape(-1,3)
+        origins = origins[(origins < shape).all(axis=1)]
+    if len(origins):
+        cells = np.stack(np.meshgrid(*[np.arange(size)]*3,indexing='ij'),-1).reshape(-1,3)
+        cells = (origins[:,None,:] + cells).reshape(-1,3)
+        cells = cells[(cells < shape).all(axis=1)]
+        for i in range(0,len(cells),_CHUNK):
+            if cancel is not None and cancel.is_set():
+                raise BuildCancelled()
+            c = cells[i:i+_CHUNK]
+            coords = np.stack([axes[d][c[:,d]] for d in range(3)],1)
+            if transform is not None:
+                coords = transform.convert(coords)
+            _, idx = tree.query(coords)
+            out[c[:,0],c[:,1],c[:,2]] = labels[idx]
+    return out
+
+def label_octree(tree, labels, axes, block=32, k=16, cancel=None, transform=None) -> LabelOctree:
+    '''Label the grid spanned by `axes` like label_grid, but return a LabelOctree.
+
+    Blocks that provably share one label become single leaves and only the
+    blocks left at the smallest size are queried cell by cell, so no dense
+    volume is ever allocated. `block` must be a power of two.
+    '''
+    labels = np.asarray(labels,dtype=np.uint8)
+    axes = [np.asarray(a,dtype=np.float64) for a in axes]
+    shape = np.array([len(a) for a in axes])
+    octree = LabelOctree(shape,(),())
+    k = min(k,len(tree.data))
+    origins = np.stack(np.meshgrid(*(np.arange(0,n,block) for n in shape),indexing='ij'),-1).reshape(-1,3)
+    # Leaves are kept as Morton codes, which take less memory than cell indices.
+    codes = []
+    leaf_labels = []
+    size = block
+    while len(origins) and size > 2:
+        if cancel is not None and cancel.is_set():
+            raise BuildCancelled()
+        uniform, lab = _uniform_blocks(tree,labels,axes,origins,np.minimum(origins+size,shape)-1,k,transform)
+        codes.append(octree.codes(origins[uniform]))
+        leaf_labels.append(lab[uniform])
+        size //= 2
+        origins = (origins[~uniform][:,None,:] + _CHILDREN*size).reshape(-1,3)
+        origins = origins[(origins < shape).all(axis=1)]
+    offsets = np.stack(np.meshgrid(*[np.arange(size)]*3,indexing='ij'),-1).reshape(-1,3)
+    per_chunk = max(1,_CHUNK // len(offsets))
+    for i in range(0,len(origins),per_chunk):
+        if cancel is not None and cancel.is_set():
+            raise BuildCancelled()
+        cells = (origins[i:i+per_chunk,None,:] + offsets).reshape(-1,3)
+        cells = cells[(cells < shape).all(axis=1)]
+        coords = np.stack([axes[d][cells[:,d]] for d in range(3)],1)
+        if transform is not None:
+            coords = transform.convert(coords)
+        _, idx = tree.query(coords)
+        leaves = octree._compact(octree.codes(cells),labels[idx])
+        codes.append(leaves[0])
+        leaf_labels.append(leaves[1])
+    octree._fill(np.concatenate(codes),np.concatenate(leaf_labels))
+    return octree
+
+def _uniform_blocks(tree, labels, axes, origins, hi, k, transform=None):
+    # Returns which blocks of grid cells, from index `origins` to `hi`
+    # inclusive, provably share one nearest label, and that label.
+    if len(origins) > _BLOCKS:
+        parts = [_uniform_blocks(tree,labels,axes,origins[i:i+_BLOCKS],hi[i:i+_BLOCKS],k,transform) for i in range(0,len(origins),_BLOCKS)]
+        return np.concatenate([u for u,_ in parts]), np.concatenate([l for _,l in parts])
+    points = tree.data
+    lo = np.stack([axes[d][origins[:,d]] for d in range(3)],1)
+    top = np.stack([axes[d][hi[:,d]] for d in range(3)],1)
+    if transform is None:
+        half = (top - lo)/2
+        centre = lo + half
+        radius = np.sqrt((half**2).sum(1))
+    else:
+        centre, radius, spread = transform.bounds(lo,top)
+    dist, idx = tree.query(centre,k=k)
+    dist = dist.reshape(len(centre),k)
+    idx = idx.reshape(len(centre),k)
+    lab = labels[idx]
+    # Any point that is nearest to some cell of the block lies within this
+    # distance of the centre, so the k nearest are the only candidates
+    # unless the k-th one is still inside it.
+    within = dist <= (dist[:,:1] + 2*radius[:,None])*(1+1e-9)
+    # A differently labelled candidate cannot win anywhere in the block if
+    # every corner is closer to the centre's nearest point than to it.
+    near = points[idx[:,0]]
+    cand = points[idx]
+    diff = cand - near[:,None,:]
+    if transform is None:
+        reach = 2*((centre[:,None,:]*diff).sum(-1) + (np.abs(diff)*half[:,None,:]).sum(-1))
+    else:
+        reach = 2*((centre[:,None,:]*diff).sum(-1) + spread(diff))
+    beaten = reach < (cand**2).sum(-1) - (near**2).sum(-1)[:,None]
+    uniform = ((lab == lab[:,:1]) | ~within | beaten).all(axis=1)
+    if k < len(points):
+        uniform &= ~within[:,-1]
+    return uniform, lab[:,0]
+
+def label_points(tree, labels, points, cancel=None):
+    '''Return the label of the nearest point in `tree` for each of an (N,3) array of points.'''
+    labels = np.asarray(labels,dtype=np.uint8)
+    out = np.empty(len(points),dtype=np.uint8)
+    for i in range(0,len(points),_CHUNK):
+        if cancel is not None and cancel.is_set():
+            raise BuildCancelled()
+        _, idx = tree.query(points[i:i+_CHUNK])
+        out[i:i+_CHUNK] = labels[idx]
+    return out
+
+def voronoi_box(tree, index, axes, k=32):
+    '''Return slices of the grid spanned by `axes` that cover every cell nearest to point `index`.
+
+    The box bounds the intersection of the bisector half-spaces between the
+    point and its `k` nearest neighbours, which contains its Voronoi cell.
+    '''
+    from scipy.optimize import linprog
+    points = tree.data
+    p = points[index]
+    _, idx = tree.query(p,k=min(k+1,len(points)))
+    q = points[np.atleast_1d(idx)]
+    q = q[(q != p).any(axis=1)]
+    A = 2*(q - p)
+    b = (q**2).sum(axis=1) - (p**2).sum()
+    bounds = [(a[0],a[-1]) for a in axes]
+    box = []
+    for d, a in enumerate(axes):
+        c = np.zeros(len(axes))
+        c[d] = 1
+        lo = linprog(c,A_ub=A,b_ub=b,bounds=bounds,method='highs')
+        hi = linprog(-c,A_ub=A,b_ub=b,bounds=bounds,method='highs')
+        if lo.status != 0 or hi.status != 0:
+            box.append(slice(0,len(a)))
+            continue
+        a = np.asarray(a)
+        box.append(slice(np.searchsorted(a,lo.x[d]-1e-6,'left'),np.searchsorted(a,hi.x[d]+1e-6,'right')))
+    return tuple(box)
+
+def _hsv_cells(points):
+    # HSV grid coordinates use the (359,99,99) scale of ColorSpaceMap.samples.
+    return np.round(hsv_to_rgb(points/(359,99,99))*255)
+
+def section_colors(view, value, step=2):
+    '''Return the colors of the cells of the section shown by `view` at `value` percent on a grid of spacing `step`, as an (H,W,3) uint8 array.'''
+    space, axis = VIEWS[view]
+    axes = [np.arange(0,n,step,dtype=np.float64) for n in EXTENTS[space]]
+    index = section_index(len(axes[axis]),value)
+    axes[axis] = axes[axis][index:index+1]
+    points = np.squeeze(np.stack(np.meshgrid(*axes,indexing='ij'),axis=-1),axis=axis).transpose(1,0,2)
+    shape = points.shape
+    if space == 'hsv':
+        return _hsv_cells(points.reshape(-1,3)).astype(np.uint8).reshape(shape)
+    return np.round(points).astype(np.uint8).reshape(shape)
+
+def render_section(section):
+    '''Color a section with LABEL_RGB as an (H,W,3) uint8 image with the y axis pointing up.'''
+    return LABEL_RGB[section[::-1]]
+
+def section_index(n, value) -> int:
+    '''Convert a cross-section percentage into an index along an axis of length `n`.'''
+    return min(max(int(float(value)/100.0*(n-1)),0),n-1)
@@ -0,0 +1,285 @@
+'''Append-only journal of the answers recorded in a session.
+
+Every change to a session is written as one fixed-size record, so a crash
+loses at most the answers since the last sync, and saving or replaying never
+rewrites earlier records. A journal starts with a one-line JSON header
+naming the session file it extends, if any, and the process that writes it.
+
+Records refer to answers by their index, so the base must load with the
+answers in the order they were given. A JSON file groups them by color
+instead; changes to one are based on a snapshot saved next to the journal.
+'''
+from json import dumps, loads
+import os
+from pathlib import Path
+import struct
+from time import monotonic
+from .session import Session, FileReadError, load_session, save_session
+
+JOURNAL_DIR = Path.home() / '.colornamespace' / 'journals'
+SUFFIX = '.journal'
+
+APPEND, RELABEL, POP = 1, 2, 3
+
+# Session formats that do not keep the answers in the order they were given.
+REORDERED = ('.json',)
+
+# op, r, g, b, label, index, time, response time
+_RECORD = struct.Struct('<BBBBBIdf')
+_NAN = float('nan')
+
+# Windows API values used to check whether a process is running.
+_PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+_ERROR_INVALID_PARAMETER = 87
+_STILL_ACTIVE = 259
+
+
+class Journal:
+    '''Writes the changes made to a session to `fpath`, replacing any file there.
+
+    `base` is the session file the changes apply to, or None for a new
+    session; `file` is the file the session belongs to, which is `base`
+    unless the journal is based on a snapshot. Records are flushed and
+    synced to disk once `sync_every` of them are pending or `sync_interval`
+    seconds have passed since the last sync, and whenever sync() is called.
+    '''
+    def __init__(self, fpath, base=None, sync_every=32, sync_interval=1.0) -> None:
+        self.fpath = Path(fpath)
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.base = None
+        self.file = None
+        self._file = None
+        self._snapshot = None
+        self.reset(base)
+
+    def __len__(self) -> int:
+        '''Number of records written since the last reset.'''
+        return self._records
+
+    @classmethod
+    def resume(cls, fpath, **kwargs):
+        '''Take over a journal left behind by another process, keeping its records.'''
+        with Path(fpath).open('rb') as st:
+            header = loads(st.readline().decode('utf-8'))
+            data = st.read()
+        journal = cls.__new__(cls)
+        journal.fpath = Path(fpath)
+        journal.sync_every = kwargs.get('sync_every',32)
+        journal.sync_interval = kwargs.get('sync_interval',1.0)
+        journal._file = None
+        journal._snapshot = Path(header['base']) if header.get('file') else None
+        journal._rewrite(header.get('base'),data[:len(data) - len(data) % _RECORD.size],header.get('file'))
+        return journal
+
+    def reset(self, base=None, session=None) -> None:
+        '''Start over from the session saved at `base`, dropping all records.
+
+        If `base` is in a format that reorders the answers, such as JSON,
+        pass the `session` that was saved: it is written as a snapshot for
+        the journal to be based on, so that recorded indexes keep pointing
+        at the same answers. The new, empty journal replaces the old one
+        with an atomic rename, so the file on disk always describes a
+        recoverable session.
+        '''
+        old = self._snapshot
+        if base is not None and session is not None and Path(base).suffix in REORDERED:
+            self._snapshot = self.fpath.with_name(f'{self.fpath.name}.{int(monotonic()*1000)}.npy')
+            save_session(session,self._snapshot)
+            self._rewrite(self._snapshot,b'',base)
+        else:
+            self._snapshot = None
+            self._rewrite(base,b'')
+        # The old snapshot goes only once no journal on disk refers to it.
+        if old is not None and old != self._snapshot:
+            old.unlink(missing_ok=True)
+
+    def _rewrite(self, base, records, file=None) -> None:
+        self.base = None if base is None else Path(base).absolute()
+        self.file = self.base if file is None else Path(file).absolute()
+        header = {'version':1,'base':None if self.base is None else str(self.base),'pid':os.getpid()}
+        if file is not None:
+            header['file'] = str(self.file)
+        header = dumps(header)
+        self.fpath.parent.mkdir(parents=True,exist_ok=True)
+        tmp = self.fpath.with_name(self.fpath.name + '.tmp')
+        with tmp.open('wb') as out:
+            out.write(header.encode('utf-8') + b'\n' + records)
+            out.flush()
+            os.fsync(out.fileno())
+        if self._file is not None:
+            self._file.close()
+        os.replace(tmp,self.fpath)
+        self._file = self.fpath.open('ab')
+        self._records = len(records) // _RECORD.size
+        self._pending = 0
+        self._synced = monotonic()
+
+    def _write(self, op, rgb=(0,0,0), label=0, index=0, time=None, response_time=None) -> None:
+        self._file.write(_RECORD.pack(op,*rgb,label,index,_NAN if time is None else time,_NAN if response_time is None else response_time))
+        self._records += 1
+        self._pending += 1
+        if self._pending >= self.sync_every or monotonic() - self._synced >= self.sync_interval:
+            self.sync()
+
+    def append(self, color, label, time=None, response_time=None) -> None:
+        '''Record an answer. `color` is a '#RRGGBB' string or an (r,g,b) triple.'''
+        rgb = (int(color[1:3],16),int(color[3:5],16),int(color[5:7],16)) if isinstance(color,str) else tuple(int(c) for c in color)
+        self._write(APPEND,rgb,label,time=time,response_time=response_time)
+
+    def relabel(self, index, label) -> None:
+        '''Record a change to the label of answer `index`.'''
+        self._write(RELABEL,label=label,index=index)
+
+    def pop(self) -> None:
+        '''Record the removal of the last answer.'''
+        self._write(POP)
+
+    def sync(self) -> None:
+        '''Flush pending records and sync them to disk.'''
+        if self._pending:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._pending = 0
+        self._synced = monotonic()
+
+    def close(self, remove=False) -> None:
+        '''Sync and close the journal, deleting the file if `remove` is set.'''
+        if self._file is None:
+            return
+        self.sync()
+        self._file.close()
+        self._file = None
+        if remove:
+            self.fpath.unlink(missing_ok=True)
+            if self._snapshot is not None:
+                self._snapshot.unlink(missing_ok=True)
+
+
+def read_header(fpath) -> dict:
+    '''Return the header of a journal file.'''
+    with Path(fpath).open('rb') as st:
+        return loads(st.readline().decode('utf-8'))
+
+def replay_journal(fpath, timed=True):
+    '''Rebuild the session described by a journal.
+
+    Returns the session, the path of the file it belongs to and the number
+    of records applied, which is 0 when the journal holds no changes to its
+    base. A record cut short by a crash is ignored. Raises FileReadError if
+    the journal or its base session cannot be read.
+    '''
+    fpath = Path(fpath)
+    try:
+        with fpath.open('rb') as st:
+            header = loads(st.readline().decode('utf-8'))
+            data = st.read()
+    except (OSError,ValueError,UnicodeDecodeError):
+        raise FileReadError('Could not read the journal header.',filename=fpath.absolute()) from None
+    base = header.get('base')
+    if base is None:
+        session = Session(timed=timed)
+    else:
+        base = Path(base)
+        try:
+            session = load_session(base,timed=timed)
+        except OSError as err:
+            raise FileReadError(f'Could not read the session the journal extends: {err}',filename=base) from None
+        if timed and not session.timed:
+            untimed = session
+            session = Session(timed=True,capacity=max(len(untimed),1))
+            session.extend(untimed.rgb,untimed.labels)
+    records = data[:len(data) - len(data) % _RECORD.size]
+    try:
+        for op, r, g, b, label, index, time, response_time in _RECORD.iter_unpack(records):
+            if op == APPEND:
+                session.append((r,g,b),label,time=time,response_time=response_time)
+            elif op == RELABEL:
+                session.relabel(index,label)
+            elif op == POP:
+                session.pop()
+            else:
+                raise ValueError(f'Unknown journal record {op}')
+    except (ValueError,IndexError):
+        raise FileReadError('Invalid record in journal.',filename=fpath.absolute()) from None
+    if header.get('file'):
+        base = Path(header['file'])
+    return session, base, len(records) // _RECORD.size
+
+def discard_journal(fpath) -> None:
+    '''Delete a journal and any snapshot it is based on, leaving files that cannot be deleted.'''
+    fpath = Path(fpath)
+    try:
+        header = read_header(fpath)
+    except (OSError,ValueError,UnicodeDecodeError):
+        header = {}
+    paths = [fpath]
+    if header.get('file') and header.get('base'):
+        paths.append(Path(header['base']))
+    for path in paths:
+        try:
+            path.unlink(missing_ok=True)
+        except OSError:
+            pass
+
+# Whether process_running() can tell a finished process from a running one here.
+CAN_CHECK_PROCESSES = os.name in ('posix','nt')
+
+def process_running(pid) -> bool:
+    '''Return whether the process `pid` is still running.
+
+    Where that cannot be checked the process is assumed to be running, so
+    that files another window still uses are never taken over or deleted.
+    '''
+    if pid == os.getpid():
+        return True
+    if os.name == 'nt':
+        return _windows_process_running(pid)
+    if os.name != 'posix':
+        return True
+    try:
+        os.kill(pid,0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+def _windows_process_running(pid) -> bool:
+    import ctypes
+    from ctypes import wintypes
+    kernel32 = ctypes.WinDLL('kernel32',use_last_error=True)
+    kernel32.OpenProcess.restype = wintypes.HANDLE
+    kernel32.OpenProcess.argtypes = (wintypes.DWORD,wintypes.BOOL,wintypes.DWORD)
+    kernel32.GetExitCodeProcess.argtypes = (wintypes.HANDLE,ctypes.POINTER(wintypes.DWORD))
+    kernel32.CloseHandle.argtypes = (wintypes.HANDLE,)
+    handle = kernel32.OpenProcess(_PROCESS_QUERY_LIMITED_INFORMATION,False,pid)
+    if not handle:
+        # Only an invalid pid proves the process has gone; access denied means it exists.
+        return ctypes.get_last_error() != _ERROR_INVALID_PARAMETER
+    try:
+        code = wintypes.DWORD()
+        if not kernel32.GetExitCodeProcess(handle,ctypes.byref(code)):
+            return True
+        return code.value == _STILL_ACTIVE
+    finally:
+        kernel32.CloseHandle(handle)
+
+def find_journals(directory=JOURNAL_DIR) -> list:
+    '''Return the journals in `directory` left behind by processes that are no longer running, newest first.'''
+    directory = Path(directory)
+    if not directory.is_dir():
+        return []
+    found = []
+    for fpath in directory.glob('*' + SUFFIX):
+        try:
+            pid = read_header(fpath).get('pid')
+        except (OSError,ValueError,UnicodeDecodeError):
+            pid = None
+        if pid is None or not process_running(pid):
+            found.append(fpath)
+    return sorted(found,key=lambda f: f.stat().st_mtime,reverse=True)
+
+def new_journal_path(directory=JOURNAL_DIR) -> Path:
+    '''Return a journal path in `directory` that is unique to this process.'''
+    return Path(directory) / f'{os.getpid()}-{int(monotonic()*1000)}{SUFFIX}'
@@ -0,0 +1,183 @@
+'''Label volumes stored as runs along the Morton curve: an octree flattened into runs.
+
+Numbering the cells of a grid in Morton (Z-curve) order puts every aligned
+octree block, of any size, on one contiguous stretch of numbers. A block
+whose cells share a label is then a single run, and a run only has to start
+where the label changes along the curve, so the number of runs grows with
+the area of the label boundaries rather than with the number of cells. That
+makes full-resolution maps small enough to keep: 256^3 cells in RGB and
+360x100x100 in HSV.
+'''
+import numpy as np
+
+# Run label marking cells outside the grid; never a real label.
+_OUTSIDE = 255
+
+# Edge of the blocks a dense volume is compressed in.
+_BLOCK = 64
+
+
+def _spread(bits):
+    # Table moving bit b of every value below 2**bits to bit 3*b.
+    values = np.arange(1 << bits,dtype=np.uint64)
+    out = np.zeros(1 << bits,dtype=np.uint64)
+    for b in range(bits):
+        out |= ((values >> np.uint64(b)) & np.uint64(1)) << np.uint64(3*b)
+    return out
+
+def _bits(shape) -> int:
+    return max(1,int(max(shape)-1).bit_length())
+
+
+class LabelOctree:
+    '''The labels of a 3-D grid of `shape` as runs in Morton order.
+
+    `starts` holds the Morton code of the first cell of each run in
+    increasing order and `labels` the label of the run, which lasts until the
+    next start. Looking a cell up is a binary search over the starts, so
+    every cell keeps its exact label. Labels must be below 255.
+    '''
+    def __init__(self, shape, starts, labels) -> None:
+        self.shape = tuple(int(n) for n in shape)
+        bits = _bits(self.shape)
+        self._dtype = np.uint32 if 3*bits <= 32 else np.uint64
+        self._table = _spread(bits).astype(self._dtype)
+        self.starts = np.asarray(starts,dtype=self._dtype)
+        self.labels = np.asarray(labels,dtype=np.uint8)
+
+    def __len__(self) -> int:
+        '''Number of runs.'''
+        return len(self.starts)
+
+    def __repr__(self) -> str:
+        return f'LabelOctree(shape={self.shape}, runs={len(self)})'
+
+    @property
+    def nbytes(self) -> int:
+        return self.starts.nbytes + self.labels.nbytes
+
+    @classmethod
+    def from_leaves(cls, shape, origins, labels):
+        '''Build the runs from octree leaves: aligned blocks given by their (N,3) origin cells and labels.
+
+        The leaves must cover every cell of the grid exactly once; a leaf may
+        reach past the edge of the grid.
+        '''
+        octree = cls(shape,(),())
+        octree._fill(octree.codes(origins),labels)
+        return octree
+
+    @staticmethod
+    def _compact(codes, labels):
+        # Sort leaves of single cells and drop each one that continues the
+        # previous cell's label at the next code; the rest cover the same cells.
+        order = np.argsort(codes)
+        codes = codes[order]
+        labels = labels[order]
+        keep = np.concatenate(([True],(labels[1:] != labels[:-1]) | (codes[1:] != codes[:-1] + 1)))
+        return codes[keep], labels[keep]
+
+    def _fill(self, codes, labels) -> None:
+        # Replace the runs with those of leaves given by their Morton codes.
+        order = np.argsort(codes,kind='stable')
+        self.starts, self.labels = _runs(codes[order],np.asarray(labels,dtype=np.uint8)[order])
+
+    @classmethod
+    def from_volume(cls, volume):
+        '''Compress a dense uint8 label volume.'''
+        volume = np.asarray(volume)
+        octree = cls(volume.shape,(),())
+        block = min(_BLOCK,1 << _bits(volume.shape))
+        local = np.stack(np.meshgrid(*[np.arange(block)]*3,indexing='ij'),-1).reshape(-1,3)
+        order = np.argsort(octree.codes(local))
+        origins = np.stack(np.meshgrid(*(np.arange(0,n,block) for n in volume.shape),indexing='ij'),-1).reshape(-1,3)
+        bases = octree.codes(origins)
+        sort = np.argsort(bases)
+        starts = []
+        labels = []
+        cells = np.empty((block,)*3,dtype=np.uint8)
+        for base, (a,b,c) in zip(bases[sort],origins[sort]):
+            part = volume[a:a+block,b:b+block,c:c+block]
+            if part.shape != cells.shape:
+                cells[...] = _OUTSIDE
+            cells[:part.shape[0],:part.shape[1],:part.shape[2]] = part
+            seq = cells.reshape(-1)[order]
+            change = np.flatnonzero(np.concatenate(([True],seq[1:] != seq[:-1])))
+            starts.append(base + change.astype(octree._dtype))
+            labels.append(seq[change])
+        octree.starts, octree.labels = _runs(np.concatenate(starts),np.concatenate(labels))
+        return octree
+
+    def patched(self, cells, labels):
+        '''Return a copy with the cells of an (N,3) array of indices given new labels.
+
+        Only runs that start at or just after a changed cell are added or
+        removed, so the cost grows with the number of cells changed and the
+        runs they fall between, not with the size of the grid.
+        '''
+        codes = self.codes(cells)
+        order = np.argsort(codes)
+        codes = codes[order]
+        labels = np.asarray(labels,dtype=np.uint8).reshape(-1)[order]
+        # A run restarts with the old label after each changed cell whose
+        # successor on the curve keeps its label.
+        after = codes + self._dtype(1)
+        after = after[~_member(after,codes)]
+        old = self.labels[np.searchsorted(self.starts,after,'right') - 1]
+        keep = ~_member(self.starts,codes)
+        starts = np.concatenate((self.starts[keep],codes,after))
+        runs = np.concatenate((self.labels[keep],labels,old))
+        order = np.argsort(starts,kind='stable')
+        octree = LabelOctree(self.shape,(),())
+        octree.starts, octree.labels = _runs(starts[order],runs[order])
+        return octree
+
+    def codes(self, cells):
+        '''Return the Morton codes of an (N,3) array of integer cell indices.'''
+        cells = np.asarray(cells).reshape(-1,3)
+        t = self._table
+        return (t[cells[:,0]] << self._dtype(2)) | (t[cells[:,1]] << self._dtype(1)) | t[cells[:,2]]
+
+    def lookup(self, cells):
+        '''Return the labels of an (N,3) array of integer cell indices.'''
+        cells = np.asarray(cells).reshape(-1,3)
+        if len(cells) and ((cells < 0).any() or (cells >= self.shape).any()):
+            raise IndexError(f'Cell index out of range for a grid of shape {self.shape}.')
+        return self.labels[np.searchsorted(self.starts,self.codes(cells),'right') - 1]
+
+    def section(self, axis, index):
+        '''Return the 2-D plane of labels at `index` along `axis`, like volume().take(index, axis).'''
+        if not 0 <= index < self.shape[axis]:
+            raise IndexError(f'Index {index} out of range for axis {axis} of length {self.shape[axis]}.')
+        t = self._table
+        shifts = [self._dtype(2-d) for d in range(3)]
+        a, b = (d for d in range(3) if d != axis)
+        codes = (t[index] << shifts[axis]) | (t[:self.shape[a],None] << shifts[a]) | (t[None,:self.shape[b]] << shifts[b])
+        return self.labels[np.searchsorted(self.starts,codes,'right') - 1]
+
+    def volume(self):
+        '''Expand the runs into a dense uint8 volume.'''
+        out = np.empty(self.shape,dtype=np.uint8)
+        for i in range(self.shape[0]):
+            out[i] = self.section(0,i)
+        return out
+
+
+def _runs(codes, labels):
+    # Sorted leaf codes and labels -> starts and labels of the runs, with
+    # cells outside the grid absorbed into the run before them.
+    inside = labels != _OUTSIDE
+    codes = codes[inside]
+    labels = labels[inside]
+    keep = np.concatenate(([True],labels[1:] != labels[:-1]))
+    starts = codes[keep]
+    if len(starts):
+        starts[0] = 0
+    return starts, labels[keep]
+
+def _member(values, codes):
+    # Which of `values` are in the sorted array `codes`.
+    if len(codes) == 0:
+        return np.zeros(len(values),dtype=bool)
+    at = np.minimum(np.searchsorted(codes,values),len(codes)-1)
+    return codes[at] == values
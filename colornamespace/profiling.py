@@ -0,0 +1,144 @@
+'''Opt-in timers and counters for the slow paths of the program.
+
+Code marks a phase with `with PROFILER.span('name'):` and counts events with
+PROFILER.count('name'). While the profiler is disabled both return at once,
+so the marks can stay in hot paths. When enabled, every span is kept (up to
+a limit) with the thread it ran on, and the whole record can be summarised
+per phase or exported as a Chrome trace, which chrome://tracing and
+Perfetto open directly.
+
+Set the COLORNAMESPACE_PROFILE environment variable to record from startup.
+'''
+from collections import deque
+from contextlib import nullcontext
+from functools import wraps
+import json
+import os
+import threading
+from time import perf_counter_ns
+
+_OFF = nullcontext()
+
+
+class _Span:
+    __slots__ = ('profiler','name','args','start')
+
+    def __init__(self, profiler, name, args) -> None:
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        end = perf_counter_ns()
+        self.profiler._spans.append((self.name,self.start,end-self.start,threading.get_ident(),self.args))
+
+
+class Profiler:
+    '''Records timed spans and counters while `enabled` is set.
+
+    At most `limit` spans are kept; older ones are dropped first.
+    '''
+    def __init__(self, enabled=False, limit=100000) -> None:
+        self.enabled = enabled
+        self._spans = deque(maxlen=limit)
+        self._counts = {}
+        self._samples = deque(maxlen=limit)
+        self._lock = threading.Lock()
+        self._origin = perf_counter_ns()
+
+    def span(self, name, **args):
+        '''Return a context manager that records the time spent in its block as `name`.
+
+        Keyword arguments are stored with the span and shown in the trace.
+        '''
+        if not self.enabled:
+            return _OFF
+        return _Span(self,name,args)
+
+    def record(self, name, start, **args) -> None:
+        '''Record a span named `name` from `start`, a perf_counter_ns() value, until now.
+
+        For phases that begin and end in different callbacks.
+        '''
+        if not self.enabled:
+            return
+        self._spans.append((name,start,perf_counter_ns()-start,threading.get_ident(),args))
+
+    def count(self, name, n=1) -> None:
+        '''Add `n` to the counter `name`.'''
+        if not self.enabled:
+            return
+        with self._lock:
+            value = self._counts.get(name,0) + n
+            self._counts[name] = value
+        self._samples.append((name,perf_counter_ns(),value))
+
+    def wrap(self, name, fn):
+        '''Return `fn` wrapped so that each call is recorded as a span named `name`.'''
+        @wraps(fn)
+        def timed(*args, **kwargs):
+            if not self.enabled:
+                return fn(*args,**kwargs)
+            with _Span(self,name,{}):
+                return fn(*args,**kwargs)
+        return timed
+
+    def clear(self) -> None:
+        '''Drop all recorded spans and counters.'''
+        with self._lock:
+            self._spans.clear()
+            self._samples.clear()
+            self._counts = {}
+
+    def counters(self) -> dict:
+        '''Return the current value of every counter.'''
+        with self._lock:
+            return dict(self._counts)
+
+    def stats(self) -> dict:
+        '''Summarise the recorded spans by name.
+
+        Returns {name: {'calls', 'total', 'mean', 'max', 'last'}}, with times
+        in seconds.
+        '''
+        stats = {}
+        for name, _, duration, _, _ in list(self._spans):
+            s = stats.get(name)
+            if s is None:
+                s = stats[name] = {'calls':0,'total':0.0,'max':0.0}
+            duration /= 1e9
+            s['calls'] += 1
+            s['total'] += duration
+            s['max'] = max(s['max'],duration)
+            s['last'] = duration
+        for s in stats.values():
+            s['mean'] = s['total']/s['calls']
+        return stats
+
+    def trace(self) -> dict:
+        '''Return the recorded spans and counters in the Chrome trace event format.'''
+        pid = os.getpid()
+        threads = {t.ident:t.name for t in threading.enumerate()}
+        events = []
+        tids = set()
+        for name, start, duration, tid, args in list(self._spans):
+            tids.add(tid)
+            events.append({'name':name,'cat':'colornamespace','ph':'X','ts':(start-self._origin)/1000,'dur':duration/1000,'pid':pid,'tid':tid,'args':args})
+        for name, at, value in list(self._samples):
+            events.append({'name':name,'cat':'colornamespace','ph':'C','ts':(at-self._origin)/1000,'pid':pid,'tid':0,'args':{name:value}})
+        for tid in tids:
+            events.append({'name':'thread_name','ph':'M','pid':pid,'tid':tid,'args':{'name':threads.get(tid,f'Thread {tid}')}})
+        return {'traceEvents':events,'displayTimeUnit':'ms'}
+
+    def save_trace(self, fpath) -> None:
+        '''Write trace() to a JSON file.'''
+        with open(fpath,'w') as out:
+            json.dump(self.trace(),out)
+
+
+# The profiler used throughout the package.
+PROFILER = Profiler(enabled=bool(os.environ.get('COLORNAMESPACE_PROFILE')))
@@ -0,0 +1,130 @@
+'''Selection of the colors shown to a participant.'''
+from itertools import product
+from random import Random
+import numpy as np
+
+FIXED_COLORS = tuple(product((0,5,15,178,240,250,255),repeat=3))
+START_COLORS = tuple(product((0,5,35,63,122,185,220,250,255),repeat=3))
+
+
+def _key(color) -> int:
+    if isinstance(color,str):
+        return int(color[1:7],base=16)
+    r, g, b = color
+    return (int(r) << 16) | (int(g) << 8) | int(b)
+
+def _hex(key) -> str:
+    return f'#{key:06X}'
+
+
+class ColorSampler:
+    '''Draws colors that have not been seen yet in constant time.
+
+    The seed palette (RGB tuples or '#RRGGBB' strings) is shuffled once and
+    handed out in that order, skipping colors already seen. Once it runs out,
+    colors are drawn uniformly at random from the whole RGB cube.
+    '''
+    def __init__(self, palette=FIXED_COLORS, seen=(), seed=None) -> None:
+        self._random = Random(seed)
+        self._palette = [_key(c) for c in palette]
+        self._random.shuffle(self._palette)
+        self._next = 0
+        self._seen = set()
+        self.mark(seen)
+
+    def __len__(self) -> int:
+        '''Number of colors seen so far.'''
+        return len(self._seen)
+
+    def __contains__(self, color) -> bool:
+        return _key(color) in self._seen
+
+    def mark(self, colors) -> None:
+        '''Record colors as seen so they are not drawn again.
+
+        `colors` holds RGB triples or '#RRGGBB' strings, or is an (N,3) array.
+        '''
+        if isinstance(colors,np.ndarray):
+            rgb = colors.astype(np.int64).reshape(-1,3)
+            self._seen.update(((rgb[:,0] << 16) | (rgb[:,1] << 8) | rgb[:,2]).tolist())
+        else:
+            self._seen.update(_key(c) for c in colors)
+
+    def remaining(self) -> int:
+        '''Number of palette colors that may still be drawn.'''
+        return sum(1 for k in self._palette[self._next:] if k not in self._seen)
+
+    def draw(self) -> str:
+        '''Return an unseen color as a '#RRGGBB' string and mark it as seen.'''
+        while self._next < len(self._palette):
+            key = self._palette[self._next]
+            self._next += 1
+            if key not in self._seen:
+                self._seen.add(key)
+                return _hex(key)
+        key = self._random.getrandbits(24)
+        while key in self._seen and len(self._seen) < 1 << 24:
+            key = self._random.getrandbits(24)
+        self._seen.add(key)
+        return _hex(key)
+
+
+class BoundarySampler(ColorSampler):
+    '''Draws colors where the current map of a ColorSpaceMap is least certain.
+
+    Once the map has `warmup` samples, most draws come from cells of a coarse
+    RGB grid (one cell every `step` units) whose label differs from a
+    neighbour's, weighted by the squared distance to the nearest sample so
+    that wide, poorly supported boundaries are sampled first. A fraction
+    `explore` of draws still comes from ColorSampler.draw.
+    '''
+    def __init__(self, colormap, palette=FIXED_COLORS, seen=(), seed=None, step=8, explore=0.2, warmup=30) -> None:
+        super().__init__(palette,seen,seed)
+        self.colormap = colormap
+        self.step = step
+        self.explore = explore
+        self.warmup = warmup
+        self._rng = np.random.default_rng(self._random.getrandbits(64))
+        self._revision = None
+        self._candidates = None
+
+    def _boundary(self):
+        if self._revision != self.colormap.revision:
+            tree, _ = self.colormap.tree('rgb')
+            axis = np.arange(self.step/2,256,self.step)
+            grid = self.colormap.label('rgb',(axis,)*3)
+            edge = np.zeros(grid.shape,dtype=bool)
+            for d in range(3):
+                lo = [slice(None)]*3
+                hi = [slice(None)]*3
+                lo[d] = slice(None,-1)
+                hi[d] = slice(1,None)
+                differ = grid[tuple(lo)] != grid[tuple(hi)]
+                edge[tuple(lo)] |= differ
+                edge[tuple(hi)] |= differ
+            cells = axis[np.argwhere(edge)]
+            if len(cells):
+                dist, _ = tree.query(cells)
+                weights = dist**2 + 1e-9
+                self._candidates = (cells,weights/weights.sum())
+            else:
+                self._candidates = None
+            self._revision = self.colormap.revision
+        return self._candidates
+
+    def draw(self) -> str:
+        '''Return an unseen color near a label boundary as a '#RRGGBB' string and mark it as seen.'''
+        if len(self.colormap) < self.warmup or self._random.random() < self.explore:
+            return super().draw()
+        candidates = self._boundary()
+        if candidates is None:
+            return super().draw()
+        cells, weights = candidates
+        for _ in range(16):
+            centre = cells[self._rng.choice(len(cells),p=weights)]
+            rgb = np.clip(np.rint(centre + self._rng.uniform(-self.step/2,self.step/2,3)),0,255).astype(int)
+            key = _key(rgb)
+            if key not in self._seen:
+                self._seen.add(key)
+                return _hex(key)
+        return super().draw()
@@ -0,0 +1,345 @@
+'''Storage for the answers recorded in a session and the files they are saved in.'''
+from itertools import islice
+from json import dumps, load, JSONDecodeError
+import os
+from pathlib import Path
+import numpy as np
+from .engine import hex_to_rgb, rgb_to_hex, COLOR_NAMES
+
+FORMATS = ('.json','.txt','.csv','.npy')
+
+# Rows handled at a time by the streaming readers and writers.
+_CHUNK = 1 << 16
+
+_HEX = [f'{i:02X}' for i in range(256)]
+_DEC = [str(i) for i in range(256)]
+_LABELS = {n:i for i,n in enumerate(COLOR_NAMES)}
+_LABELS.update({str(i):i for i in range(len(COLOR_NAMES))})
+
+
+class FileReadError(Exception):
+    '''Error returned when file exists but could not be correctly parsed.'''
+    def __init__(self, *args: object, filename=None) -> None:
+        super().__init__(*args)
+        self.filename = filename
+
+
+class Session:
+    '''Answers stored in typed arrays: uint8 RGB (N,3) and uint8 label indices.
+
+    With `timed` set, the time of each answer (seconds since the epoch) and
+    its response time (seconds) are kept as well, NaN where unknown.
+    Indexing and iteration yield ('#RRGGBB', label) tuples like the list of
+    tuples this class replaces. The `rgb`, `labels`, `times` and
+    `response_times` properties are views into the storage and are
+    invalidated by the next append.
+    '''
+    def __init__(self, data=(), timed=False, capacity=1024) -> None:
+        self.timed = timed
+        self._n = 0
+        self._rgb = np.zeros((capacity,3),dtype=np.uint8)
+        self._labels = np.zeros(capacity,dtype=np.uint8)
+        if timed:
+            self._times = np.full(capacity,np.nan)
+            self._response_times = np.full(capacity,np.nan,dtype=np.float32)
+        data = list(data)
+        if len(data) > 0:
+            self.extend(hex_to_rgb([c for c,_ in data]),[i for _,i in data])
+
+    @classmethod
+    def from_arrays(cls, rgb, labels, times=None, response_times=None, copy=True):
+        '''Build a session from an (N,3) array of colors and N label indices.
+
+        Without `copy` the session uses the given uint8 arrays (for example
+        memory-mapped ones) as its storage until it has to grow, or until a
+        label is changed if they are read-only.
+        '''
+        timed = times is not None or response_times is not None
+        if copy:
+            session = cls(timed=timed,capacity=max(len(labels),1))
+            session.extend(rgb,labels,times,response_times)
+            return session
+        session = cls(timed=False,capacity=1)
+        session._rgb = rgb
+        session._labels = labels
+        session._n = len(labels)
+        if timed:
+            session.timed = True
+            session._times = np.full(len(labels),np.nan) if times is None else times
+            session._response_times = np.full(len(labels),np.nan,dtype=np.float32) if response_times is None else response_times
+        return session
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __getitem__(self, index):
+        index = self._index(index)
+        r, g, b = self._rgb[index].tolist()
+        return (f'#{r:02X}{g:02X}{b:02X}',int(self._labels[index]))
+
+    def __iter__(self):
+        return zip(rgb_to_hex(self.rgb),self.labels.tolist())
+
+    def _index(self, index) -> int:
+        if index < 0:
+            index += self._n
+        if not 0 <= index < self._n:
+            raise IndexError('Session index out of range')
+        return index
+
+    def _reserve(self, n) -> None:
+        capacity = len(self._labels)
+        if n <= capacity:
+            return
+        # Empty storage, such as a memory map of an empty file, has nothing to double.
+        capacity = max(capacity,1)
+        while capacity < n:
+            capacity *= 2
+        for name in ('_rgb','_labels','_times','_response_times'):
+            if hasattr(self,name):
+                old = getattr(self,name)
+                new = np.full((capacity,)+old.shape[1:],np.nan if old.dtype.kind=='f' else 0,dtype=old.dtype)
+                new[:self._n] = old[:self._n]
+                setattr(self,name,new)
+
+    @property
+    def rgb(self):
+        return self._rgb[:self._n]
+
+    @property
+    def labels(self):
+        return self._labels[:self._n]
+
+    @property
+    def times(self):
+        return self._times[:self._n] if self.timed else None
+
+    @property
+    def response_times(self):
+        return self._response_times[:self._n] if self.timed else None
+
+    def colors(self) -> list:
+        '''Return the colors as '#RRGGBB' strings.'''
+        return rgb_to_hex(self.rgb)
+
+    def append(self, color, label, time=None, response_time=None) -> None:
+        '''Add one answer. `color` is a '#RRGGBB' string or an (r,g,b) triple.'''
+        self._reserve(self._n+1)
+        self._rgb[self._n] = hex_to_rgb([color])[0] if isinstance(color,str) else color
+        self._labels[self._n] = label
+        if self.timed:
+            self._times[self._n] = np.nan if time is None else time
+            self._response_times[self._n] = np.nan if response_time is None else response_time
+        self._n += 1
+
+    def extend(self, rgb, labels, times=None, response_times=None) -> None:
+        '''Add many answers from an (N,3) array of colors and N label indices.'''
+        rgb = np.asarray(rgb,dtype=np.uint8).reshape(-1,3)
+        n = self._n + len(rgb)
+        self._reserve(n)
+        self._rgb[self._n:n] = rgb
+        self._labels[self._n:n] = labels
+        if self.timed:
+            self._times[self._n:n] = np.nan if times is None else times
+            self._response_times[self._n:n] = np.nan if response_times is None else response_times
+        self._n = n
+
+    def relabel(self, index, label) -> None:
+        '''Change the label of one answer in place.'''
+        index = self._index(index)
+        if not self._labels.flags.writeable:
+            # Read-only memory maps are copied on the first change.
+            self._labels = self._labels.copy()
+        self._labels[index] = label
+
+    def pop(self):
+        '''Remove the last answer and return it as a ('#RRGGBB', label) tuple.'''
+        item = self[-1]
+        self._n -= 1
+        return item
+
+
+def _record_dtype(timed):
+    fields = [('rgb',np.uint8,(3,)),('label',np.uint8)]
+    if timed:
+        fields += [('time',np.float64),('response_time',np.float32)]
+    return np.dtype(fields)
+
+def _chunks(n):
+    return ((i,min(i+_CHUNK,n)) for i in range(0,n,_CHUNK))
+
+def _format_rows(fields) -> bytes:
+    '''Format rows of text without a Python loop over the rows.
+
+    Each field is a (strings, indices) pair giving the text of that field in
+    every row as strings[indices]; an index of None repeats strings[0].
+    Returns the rows separated by newlines.
+    '''
+    n = max(len(v) for _,v in fields if v is not None)
+    tables = []
+    width = np.ones(n,dtype=np.int64)
+    for strings, values in fields:
+        values = np.zeros(n,dtype=np.intp) if values is None else np.asarray(values,dtype=np.intp)
+        raw = [a.encode('utf-8') for a in strings]
+        lengths = np.array([len(a) for a in raw])
+        table = np.zeros((len(raw),lengths.max()),dtype=np.uint8)
+        for i, a in enumerate(raw):
+            table[i,:len(a)] = np.frombuffer(a,dtype=np.uint8)
+        tables.append((table,lengths,values))
+        width += lengths[values]
+    out = np.full(int(width.sum()),ord('\n'),dtype=np.uint8)
+    pos = np.cumsum(width) - width
+    for table, lengths, values in tables:
+        size = lengths[values]
+        for w in np.unique(size):
+            rows = np.flatnonzero(size == w)
+            out[pos[rows,None] + np.arange(w)] = table[values[rows],:w]
+        pos += size
+    return out[:-1].tobytes()
+
+def save_session(session, fpath) -> None:
+    '''Write a session to a .json, .txt, .csv or .npy file, a chunk of rows at a time.
+
+    The rows go to a temporary file next to `fpath`, which is synced and then
+    renamed over it, so an interrupted save leaves any earlier file intact.
+    '''
+    fpath = Path(fpath)
+    if fpath.suffix not in FORMATS:
+        raise ValueError(f'Unsupported file type: {fpath.suffix}')
+    tmp = fpath.with_name(f'.{fpath.name}.{os.getpid()}.tmp')
+    try:
+        _write_session(session,tmp,fpath.suffix)
+        with tmp.open('rb+') as st:
+            os.fsync(st.fileno())
+        os.replace(tmp,fpath)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+def _write_session(session, fpath, suffix) -> None:
+    rgb, labels = session.rgb, session.labels
+    if suffix == '.npy':
+        out = np.lib.format.open_memmap(fpath,mode='w+',dtype=_record_dtype(session.timed),shape=(len(session),))
+        for a, b in _chunks(len(session)):
+            out['rgb'][a:b] = rgb[a:b]
+            out['label'][a:b] = labels[a:b]
+            if session.timed:
+                out['time'][a:b] = session.times[a:b]
+                out['response_time'][a:b] = session.response_times[a:b]
+        out.flush()
+        del out
+        return
+    names = [dumps(n) for n in COLOR_NAMES] if suffix == '.json' else COLOR_NAMES
+    with fpath.open('w') as out:
+        if suffix == '.json':
+            # Group answers by color in order of first appearance.
+            wide = rgb.astype(np.int64)
+            keys = (wide[:,0] << 16) | (wide[:,1] << 8) | wide[:,2]
+            _, first, inverse = np.unique(keys,return_index=True,return_inverse=True)
+            rank = np.argsort(np.argsort(first))
+            order = np.argsort(rank[inverse],kind='stable')
+            out.write('{')
+            last = None
+            for a, b in _chunks(len(order)):
+                idx = order[a:b]
+                parts = []
+                for key, label in zip(keys[idx].tolist(),labels[idx].tolist()):
+                    if key != last:
+                        parts.append(('], ' if last is not None else '') + f'"#{key:06X}": [' + names[label])
+                        last = key
+                    else:
+                        parts.append(', ' + names[label])
+                out.write(''.join(parts))
+            out.write(']}' if last is not None else '}')
+        elif suffix == '.txt':
+            for a, b in _chunks(len(labels)):
+                out.write(('\n' if a else '') + _format_rows([(['#'],None),(_HEX,rgb[a:b,0]),(_HEX,rgb[a:b,1]),(_HEX,rgb[a:b,2]),([':'],None),(names,labels[a:b])]).decode())
+        elif suffix == '.csv':
+            out.write('r,g,b,idx,color')
+            for a, b in _chunks(len(labels)):
+                out.write('\n' + _format_rows([(_DEC,rgb[a:b,0]),([','],None),(_DEC,rgb[a:b,1]),([','],None),(_DEC,rgb[a:b,2]),([','],None),(_DEC,labels[a:b]),([','],None),(names,labels[a:b])]).decode())
+
+def _label_index(label) -> int:
+    if isinstance(label,str):
+        label = label.strip()
+        if label.isdigit():
+            return int(label)
+        return COLOR_NAMES.index(label)
+    if label != round(label):
+        raise ValueError(f'Invalid label: {label!r}')
+    return int(label)
+
+def load_session(fpath, timed=False, mmap_mode=None) -> Session:
+    '''Read a session from a .json, .txt, .csv or .npy file.
+
+    Text formats are parsed a chunk of lines at a time. An .npy file is
+    memory-mapped when `mmap_mode` is given, and the session then reads
+    straight from the mapping. Raises FileReadError for malformed files.
+    '''
+    fpath = Path(fpath)
+    kind = fpath.suffix.capitalize()[1:]
+    try:
+        if fpath.suffix == '.npy':
+            rec = np.load(fpath,mmap_mode=mmap_mode)
+            if 'rgb' not in (rec.dtype.names or ()) or 'label' not in rec.dtype.names:
+                raise ValueError('Missing fields')
+            rgb, labels = _check_records(rec['rgb'],rec['label'])
+            times = rec['time'] if 'time' in rec.dtype.names else None
+            response_times = rec['response_time'] if 'response_time' in rec.dtype.names else None
+            session = Session.from_arrays(rgb,labels,times,response_times,copy=mmap_mode is None)
+        elif fpath.suffix == '.json':
+            session = Session(timed=timed)
+            with fpath.open('r') as st:
+                d = load(st)
+            colors = []
+            labels = []
+            for c, names in d.items():
+                for n in ([names] if isinstance(names,(str,int,float)) else names):
+                    colors.append(c)
+                    labels.append(_label_index(n))
+            session.extend(hex_to_rgb(colors),_check_labels(labels))
+        elif fpath.suffix in ('.txt','.csv'):
+            session = Session(timed=timed)
+            with fpath.open('r') as st:
+                if fpath.suffix == '.csv':
+                    next(st,None)
+                while True:
+                    lines = [a.strip() for a in islice(st,_CHUNK)]
+                    if len(lines) == 0:
+                        break
+                    lines = [a for a in lines if a and not a.startswith('%')]
+                    if len(lines) == 0:
+                        continue
+                    if fpath.suffix == '.txt':
+                        rows = [a.split(':') for a in lines]
+                        session.extend(hex_to_rgb([c for c,_ in rows]),[_LABELS[i.strip()] for _,i in rows])
+                    else:
+                        rows = np.loadtxt(lines,delimiter=',',usecols=(0,1,2,3),dtype=np.int64,ndmin=2)
+                        if ((rows[:,:3] < 0) | (rows[:,:3] > 255)).any():
+                            raise ValueError('Color out of range')
+                        session.extend(rows[:,:3],_check_labels(rows[:,3]))
+        else:
+            raise FileReadError(f'Unsupported file type: {fpath.suffix}',filename=fpath.absolute())
+    except JSONDecodeError as err:
+        raise FileReadError(f'Could not read JSON file: {err.msg}',filename=fpath.absolute()) from None
+    except (ValueError,TypeError,AttributeError,IndexError,KeyError):
+        raise FileReadError(f'Invalid data encountered in {kind} file.',filename=fpath.absolute()) from None
+    return session
+
+def _check_labels(labels):
+    labels = np.asarray(labels)
+    if ((labels < 0) | (labels >= len(COLOR_NAMES))).any():
+        raise ValueError('Label out of range')
+    return labels
+
+def _check_records(rgb, labels):
+    # Checks the colors and labels of an .npy file a chunk at a time, so a
+    # memory-mapped file is not read into memory at once, and returns them
+    # as uint8 arrays.
+    if rgb.shape[1:] != (3,) or rgb.dtype.kind not in 'iu' or labels.dtype.kind not in 'iu':
+        raise ValueError('Invalid fields')
+    for a, b in _chunks(len(labels)):
+        _check_labels(labels[a:b])
+        if rgb.dtype != np.uint8 and ((rgb[a:b] < 0) | (rgb[a:b] > 255)).any():
+            raise ValueError('Color out of range')
+    return rgb.astype(np.uint8,copy=False), labels.astype(np.uint8,copy=False)
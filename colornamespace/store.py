@@ -0,0 +1,192 @@
+'''Samples and label volumes shared between windows and processes through memory-mapped files.
+
+A MapStore is a directory of .npy files: the samples of one session and the
+label volumes built from them. Each file is written once, to a temporary
+name that is then renamed into place, and never changed afterwards, so any
+number of windows and worker processes can memory-map it read-only at the
+same time. The operating system keeps a single copy in its page cache, and
+memory no longer grows with every window that shows the same map.
+
+Stores take memory until they are deleted, so each process using one marks
+it with acquire() and release(), and the last release deletes it. Stores
+left by processes that died without releasing them are pruned whenever a
+store is looked up.
+'''
+from hashlib import sha1
+from itertools import count
+import os
+from pathlib import Path
+import shutil
+import tempfile
+from time import time
+import numpy as np
+from .engine import ColorSpaceMap
+from .journal import CAN_CHECK_PROCESSES, process_running
+from .session import load_session, save_session
+
+# Stores live in memory-backed /dev/shm where there is one.
+STORE_DIR = (Path('/dev/shm') if Path('/dev/shm').is_dir() else Path(tempfile.gettempdir())) / f'colornamespace-{os.getuid() if hasattr(os,"getuid") else "maps"}'
+
+VOLUMES = ('rgb','hsv','lut')
+
+# Seconds a store without users is kept, so one being set up is not pruned.
+PRUNE_AGE = 60
+
+_USERS = count()
+
+
+class MapStore:
+    '''Shared samples and label volumes kept as .npy files in the directory `path`.'''
+    def __init__(self, path) -> None:
+        self.path = Path(path)
+        self._user = None
+
+    def __repr__(self) -> str:
+        return f'MapStore({str(self.path)!r})'
+
+    @classmethod
+    def for_file(cls, fpath, root=STORE_DIR):
+        '''Return the store for the current contents of a session file.
+
+        The store is named after the file's path, size and modification
+        time, so every window opening the same file finds the same store.
+        Stores in `root` that no running process uses are removed first.
+        '''
+        fpath = Path(fpath).absolute()
+        stat = fpath.stat()
+        prefix = sha1(str(fpath).encode('utf-8')).hexdigest()[:16]
+        version = sha1(f'{stat.st_size}:{stat.st_mtime_ns}'.encode('utf-8')).hexdigest()[:8]
+        prune(root)
+        return cls(Path(root) / f'{prefix}-{version}')
+
+    def acquire(self) -> None:
+        '''Mark the store as used by this process until release() is called.'''
+        if self._user is not None:
+            return
+        self.path.mkdir(parents=True,exist_ok=True)
+        user = self.path / f'.{os.getpid()}-{next(_USERS)}.user'
+        user.touch()
+        self._user = user
+
+    def release(self) -> None:
+        '''Stop using the store, deleting it if no running process uses it any more.'''
+        if self._user is None:
+            return
+        self._user.unlink(missing_ok=True)
+        self._user = None
+        if not self.in_use():
+            self.remove()
+
+    def in_use(self) -> bool:
+        '''Return whether a running process has acquired the store.'''
+        for user in self.path.glob('.*.user'):
+            try:
+                pid = int(user.name[1:].split('-')[0])
+            except ValueError:
+                continue
+            if process_running(pid):
+                return True
+        return False
+
+    def has_session(self) -> bool:
+        return (self.path / 'samples.npy').exists()
+
+    def publish_session(self, session) -> None:
+        '''Write the samples of a session to the store, replacing any there.
+
+        A process that keeps using the session should switch to session(),
+        so that its samples are not held in memory twice.
+        '''
+        self.path.mkdir(parents=True,exist_ok=True)
+        save_session(session,self.path / 'samples.npy')
+
+    def session(self):
+        '''Return the stored session, reading straight from a read-only memory map.
+
+        The session copies its arrays on the first change, leaving the store intact.
+        '''
+        return load_session(self.path / 'samples.npy',mmap_mode='r')
+
+    def _volume_path(self, key, step, metric) -> Path:
+        return self.path / f'{key}-{step}-{metric or "native"}.npy'
+
+    def publish(self, colormap) -> list:
+        '''Write every volume the ColorSpaceMap has built that the store does not hold yet.
+
+        The map must have been built from the stored session. Returns the
+        keys written.
+        '''
+        written = []
+        for key in VOLUMES:
+            fpath = self._volume_path(key,colormap.step,colormap.metric)
+            if not colormap.built(key) or fpath.exists():
+                continue
+            self.path.mkdir(parents=True,exist_ok=True)
+            tmp = fpath.with_name(f'.{fpath.name}.{os.getpid()}.tmp')
+            try:
+                with tmp.open('wb') as out:
+                    np.save(out,colormap.lut() if key == 'lut' else colormap.volume(key))
+                os.replace(tmp,fpath)
+            except BaseException:
+                tmp.unlink(missing_ok=True)
+                raise
+            written.append(key)
+        return written
+
+    def volume(self, key, step=2, metric=None):
+        '''Return a read-only memory map of a stored volume ('rgb', 'hsv' or 'lut'), or None if there is none.'''
+        fpath = self._volume_path(key,step,metric)
+        try:
+            return np.load(fpath,mmap_mode='r')
+        except FileNotFoundError:
+            return None
+
+    def attach(self, step=2, metric=None, **kwargs) -> ColorSpaceMap:
+        '''Return a ColorSpaceMap of the stored session that uses every stored volume without copying it.
+
+        Further keyword arguments go to ColorSpaceMap. Volumes it builds
+        later can be shared with publish().
+        '''
+        colormap = ColorSpaceMap(self.session(),step=step,metric=metric,**kwargs)
+        self.adopt(colormap)
+        return colormap
+
+    def adopt(self, colormap) -> list:
+        '''Give a ColorSpaceMap of the stored session the stored volumes it has not built, and return their keys.'''
+        adopted = []
+        for key in VOLUMES:
+            if colormap.built(key):
+                continue
+            vol = self.volume(key,colormap.step,colormap.metric)
+            if vol is not None:
+                colormap.set_volume(key,vol)
+                adopted.append(key)
+        return adopted
+
+    def remove(self) -> None:
+        '''Delete the store. Memory maps that are still open stay valid.'''
+        shutil.rmtree(self.path,ignore_errors=True)
+
+
+def prune(root=STORE_DIR, age=PRUNE_AGE) -> list:
+    '''Delete the stores in `root` that no running process uses and that have not changed for `age` seconds.
+
+    Returns the paths removed. Nothing is removed on systems where it
+    cannot be checked whether a process is running.
+    '''
+    root = Path(root)
+    if not CAN_CHECK_PROCESSES or not root.is_dir():
+        return []
+    removed = []
+    now = time()
+    for path in root.iterdir():
+        try:
+            if not path.is_dir() or now - path.stat().st_mtime < age:
+                continue
+        except OSError:
+            continue
+        store = MapStore(path)
+        if not store.in_use():
+            store.remove()
+            removed.append(path)
+    return removed
@@ -12,7 +12,7 @@ setup(
     author='Benton Greene',
     author_email='bgreene101@gmail.com',
     packages=find_packages(),
-    install_requires=["numpy","scipy","matplotlib","pillow"],
-    python_requires=">=3.7",
+    install_requires=["numpy","scipy>=1.6","matplotlib>=3.4","pillow"],
+    python_requires=">=3.8",
     entry_points={'gui_scripts':['ColorNameMapper = colornamespace.__main__:main']}
 )
\ No newline at end of file
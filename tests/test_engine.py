@@ -0,0 +1,18 @@
+import numpy as np
+from scipy.spatial import cKDTree
+from colornamespace.engine import label_grid
+
+
+def test_label_grid_ties_match_cell_queries():
+    # Samples on a coarse lattice leave many cells exactly as near to two
+    # differently labelled samples.
+    rng = np.random.default_rng(0)
+    points = np.unique(rng.integers(0,16,(60,3))*8.0,axis=0)
+    labels = rng.integers(0,11,len(points)).astype(np.uint8)
+    tree = cKDTree(points)
+    axes = [np.arange(0,128,2.0)]*3
+    cells = np.stack(np.meshgrid(*axes,indexing='ij'),-1).reshape(-1,3)
+    dist, idx = tree.query(cells,k=2)
+    assert ((dist[:,0] == dist[:,1]) & (labels[idx[:,0]] != labels[idx[:,1]])).sum() > 1000
+    _, idx = tree.query(cells)
+    assert (label_grid(tree,labels,axes) == labels[idx].reshape(64,64,64)).all()
@@ -0,0 +1,23 @@
+import numpy as np
+from colornamespace.session import Session, load_session, save_session
+
+
+def test_append_to_empty_memory_mapped_session(tmp_path):
+    fpath = tmp_path / 'empty.npy'
+    save_session(Session(timed=True),fpath)
+    session = load_session(fpath,mmap_mode='r')
+    assert len(session) == 0
+    session.append('#FF8000',2,time=1.0,response_time=0.5)
+    assert list(session) == [('#FF8000',2)]
+    assert session.times.tolist() == [1.0]
+
+def test_append_to_empty_uncopied_arrays():
+    session = Session.from_arrays(np.zeros((0,3),dtype=np.uint8),np.zeros(0,dtype=np.uint8),copy=False)
+    session.append('#000000',9)
+    session.extend([(1,2,3),(4,5,6)],[0,1])
+    assert len(session) == 3
+
+def test_zero_capacity():
+    session = Session(capacity=0)
+    session.append('#FFFFFF',10)
+    assert list(session) == [('#FFFFFF',10)]